@@ -0,0 +1,139 @@
+import json
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from processing.alg_cumulative_wealth_gain import CumulativeWealthGain
+from processing.alg_cumulative_wealth_gain_array import CumulativeWealthGainArray
+from processing.alg_transaction_counting import TransactionCounting
+from processing.alg_defi_transactions import DefiTransactions
+from processing.multi_window import MultiWindow
+
+SECONDS_PER_SLOT = 12
+
+# engine name: (analysis config key whose deltas it runs, factory of one instance per delta)
+ENGINES = {
+    "cumulative_wealth_gain": ("cumulative_wealth_gain", CumulativeWealthGain),
+    "cumulative_wealth_gain_array": ("cumulative_wealth_gain", CumulativeWealthGainArray),
+    "transaction_counting": ("transaction_counting", TransactionCounting),
+    "defi_transactions": ("defi_transactions", DefiTransactions),
+}
+
+
+def generate_blocks(blocks=10000, addresses=100000, transfers_per_block=50, defi_share=0.2, seed=0, start_time=1748736000):
+    # Seeded synthetic blocks in the format of the analysis loop: {"timestamp", "transactions"}.
+    # Transfer counts are Poisson distributed around transfers_per_block, addresses are drawn uniformly from
+    # addresses distinct ones and usd values are lognormal. defi_share of the transfers are the two legs of
+    # swap transactions (same hash, the second leg returns about the same value), the others have a hash each
+    rng = np.random.default_rng(seed)
+    result = []
+    tx_number = 0
+    for number in range(blocks):
+        n = int(rng.poisson(transfers_per_block))
+        senders = rng.integers(0, addresses, n)
+        receivers = rng.integers(0, addresses, n)
+        values = rng.lognormal(5, 2, n)
+        swaps = rng.random(n) < defi_share
+        transactions = []
+        i = 0
+        while i < n:
+            if swaps[i] and i + 1 < n:
+                hash = f"0x{tx_number:064x}"
+                transactions.append({"hash": hash, "from": f"0x{senders[i]:040x}", "to": f"0x{receivers[i]:040x}", "usd_value": float(values[i])})
+                transactions.append({"hash": hash, "from": f"0x{receivers[i]:040x}", "to": f"0x{senders[i]:040x}", "usd_value": float(values[i] * rng.uniform(0.97, 1.03))})
+                i += 2
+            else:
+                transactions.append({"hash": f"0x{tx_number:064x}", "from": f"0x{senders[i]:040x}", "to": f"0x{receivers[i]:040x}", "usd_value": float(values[i])})
+                i += 1
+            tx_number += 1
+        result.append({"timestamp": float(start_time + number * SECONDS_PER_SLOT), "transactions": transactions})
+    return result
+
+
+def measure(factory, blocks):
+    # one timing pass with perf_counter_ns per block and, on a fresh instance, one tracemalloc pass,
+    # so that tracing does not distort the latencies
+    algorithm = factory()
+    latencies = np.empty(len(blocks), dtype=np.int64)
+    for i, block in enumerate(blocks):
+        start = time.perf_counter_ns()
+        algorithm.run_on_block(block)
+        latencies[i] = time.perf_counter_ns() - start
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        algorithm = factory()
+        for block in blocks:
+            algorithm.run_on_block(block)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    transfers = sum(len(block["transactions"]) for block in blocks)
+    total = int(latencies.sum())
+    return {
+        "blocks": len(blocks),
+        "transfers": transfers,
+        "p50_us": float(np.percentile(latencies, 50)) / 1e3,
+        "p99_us": float(np.percentile(latencies, 99)) / 1e3,
+        "mean_us": float(latencies.mean()) / 1e3 if len(blocks) else 0.0,
+        "total_s": total / 1e9,
+        "blocks_per_s": len(blocks) / (total / 1e9) if total else 0.0,
+        "transfers_per_s": transfers / (total / 1e9) if total else 0.0,
+        "peak_bytes": peak - before,
+        "retained_bytes": current - before,
+    }
+
+
+def run_suite(analysis, engines, generator):
+    # every engine for every delta of its analysis config key, and "multi_window" for all deltas at once
+    blocks = generate_blocks(**generator)
+    results = []
+    for engine in engines:
+        if engine == "multi_window":
+            result = measure(
+                lambda: MultiWindow(
+                    analysis["cumulative_wealth_gain"],
+                    analysis["transaction_counting"],
+                    analysis["defi_transactions"],
+                ),
+                blocks,
+            )
+            results.append({"engine": engine, "delta": None, **result})
+            continue
+        key, factory = ENGINES[engine]
+        for delta in analysis[key]:
+            results.append({"engine": engine, "delta": delta, **measure(lambda: factory(delta), blocks)})
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "generator": generator,
+        "results": results,
+    }
+
+
+def save(report, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        json.dump(report, f, indent=2)
+
+
+def compare(baseline, report, threshold=0.1):
+    # the results that are more than threshold slower (p50, p99 or throughput) than in the baseline report
+    previous = {(result["engine"], result["delta"]): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["engine"], result["delta"]))
+        if before is None:
+            continue
+        for metric, higher_is_worse in (("p50_us", True), ("p99_us", True), ("transfers_per_s", False)):
+            if before[metric] == 0:
+                continue
+            change = result[metric] / before[metric] - 1
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append((result["engine"], result["delta"], metric, before[metric], result[metric]))
+    return regressions
@@ -0,0 +1,92 @@
+import hashlib
+import multiprocessing as mp
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+# A plot is described by a spec of plain data, so that it can be hashed and sent to a worker process:
+#   path, title, x_title, y_title, y2_title, y_range, y2_range, legend_title
+#   traces: [{"x", "y", "name", "secondary_y", "dash"}]
+# It is rendered to path with the format given by its suffix: .svg, .png or .html
+
+
+def spec_hash(spec, webgl):
+    return hashlib.sha256(pickle.dumps((spec, webgl), protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def hash_path(path):
+    # the content hash of the spec a plot was rendered from, next to the plot
+    return path.with_name(path.name + ".sha256")
+
+
+def build_figure(spec, webgl=False):
+    # plotly is imported here, the main process only needs it when it renders itself
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    scatter = go.Scattergl if webgl else go.Scatter
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    for trace in spec["traces"]:
+        fig.add_trace(
+            scatter(
+                x=trace["x"],
+                y=trace["y"],
+                mode="lines",
+                name=trace["name"],
+                line=dict(dash=trace["dash"], width=2) if trace.get("dash") else None,
+            ),
+            secondary_y=trace.get("secondary_y", False),
+        )
+    fig.update_yaxes(title_text=spec["y_title"], secondary_y=False, range=spec["y_range"])
+    fig.update_yaxes(title_text=spec["y2_title"], secondary_y=True, range=spec["y2_range"])
+    fig.update_layout(
+        title=spec["title"],
+        legend_title=spec["legend_title"],
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        ),
+    )
+    fig.update_xaxes(title_text=spec["x_title"])
+    return fig
+
+
+def render(spec, webgl=False):
+    path = Path(spec["path"])
+    if path.suffix == ".html":
+        # self contained, WebGL traces keep large series interactive
+        build_figure(spec, webgl).write_html(path, include_plotlyjs=True, full_html=True)
+    elif path.suffix in (".svg", ".png"):
+        build_figure(spec).write_image(path, scale=1)
+    else:
+        raise ValueError(f"unknown plot format {path.suffix}")
+    return path
+
+
+def render_all(specs, processes=0, webgl=True):
+    # Renders every spec whose content hash differs from the one of its existing plot, in a process pool
+    # of that size (0 renders in this process). Returns the paths that were rendered
+    pending = []
+    for spec in specs:
+        path = Path(spec["path"])
+        digest = spec_hash(spec, webgl and path.suffix == ".html")
+        if path.exists() and hash_path(path).exists() and hash_path(path).read_text() == digest:
+            continue
+        pending.append((spec, digest))
+
+    if processes > 0 and len(pending) > 1:
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending)), mp_context=ctx) as executor:
+            futures = [executor.submit(render, spec, webgl) for spec, _ in pending]
+            paths = [future.result() for future in futures]
+    else:
+        paths = [render(spec, webgl) for spec, _ in pending]
+
+    # written after the plot, an interrupted render is redone next time
+    for path, (_, digest) in zip(paths, pending):
+        hash_path(path).write_text(digest)
+    return paths
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def rolling_sum(values, window):
+    # the sums of all full windows, same as numpy.convolve(values, ones(window), mode="valid") in O(n)
+    values = np.asarray(values, dtype=np.float64)
+    if window > len(values):
+        return np.empty(0, dtype=np.float64)
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[window:] - cumulative[:-window]
+
+
+def rolling_percentage(numerator, denominator, window):
+    # rolling_sum(numerator) in % of rolling_sum(denominator), NaN where the denominator window sums to 0
+    numerator_sum = rolling_sum(numerator, window)
+    denominator_sum = rolling_sum(denominator, window)
+    return np.divide(
+        numerator_sum, denominator_sum,
+        out=np.full_like(numerator_sum, np.nan),
+        where=denominator_sum != 0,
+    ) * 100.0
+
+
+def lttb(y, n_out):
+    # Largest-Triangle-Three-Buckets over equidistant points, returns the indices of the kept points.
+    # The first and last point are kept, every bucket in between contributes the point spanning the
+    # largest triangle with the previously kept point and the average of the next bucket
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # NaN points are only kept if a bucket has nothing else
+    filled = np.where(np.isnan(y), 0.0, y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        average_x = (next_start + next_end - 1) / 2
+        average_y = filled[next_start:next_end].mean()
+        x = np.arange(start, end)
+        area = np.abs((a - average_x) * (filled[start:end] - filled[a]) - (a - x) * (average_y - filled[a]))
+        area[np.isnan(y[start:end])] = -1
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def min_max(y, n_out):
+    # the indices of the minimum and the maximum of n_out // 2 equal buckets, in order
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    buckets = n_out // 2
+    if n_out >= n or buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    low = np.where(np.isnan(y), np.inf, y)
+    high = np.where(np.isnan(y), -np.inf, y)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        indices.append(start + int(np.argmin(low[start:end])))
+        indices.append(start + int(np.argmax(high[start:end])))
+    return np.unique(indices)
+
+
+def downsample(x, y, max_points, method="lttb"):
+    # at most about max_points points of a trace for plotting, method lttb | minmax | none
+    if method == "none" or max_points is None or len(y) <= max_points:
+        return x, y
+    if method == "lttb":
+        indices = lttb(y, max_points)
+    elif method == "minmax":
+        indices = min_max(y, max_points)
+    else:
+        raise ValueError(f"unknown downsampling method {method}")
+    return [x[i] for i in indices.tolist()], np.asarray(y, dtype=np.float64)[indices]
@@ -1,24 +1,26 @@
-from datetime import datetime
+import time
 
 
 class SpeedComparison:
     def __init__(self, algorithm, delta):
         self.algorithm = algorithm
         self.delta = delta
+        # nanoseconds of every run_on_block
         self.time_sliding_window = []
+        # nanoseconds summed over consecutive windows of delta seconds of block time
         self.time_build_up_window = []
-        self.iteration = 0
+        self.window_start = None
 
     def run_on_block(self, block):
-        now = datetime.now()
+        start = time.perf_counter_ns()
         gain = self.algorithm.run_on_block(block)
-        time_delta = datetime.now() - now
-        
+        time_delta = time.perf_counter_ns() - start
+
         self.time_sliding_window.append(time_delta)
 
-        if self.iteration % self.delta == 0:
+        if self.window_start is None or block["timestamp"] - self.window_start >= self.delta:
+            self.window_start = block["timestamp"]
             self.time_build_up_window.append(time_delta)
         else:
             self.time_build_up_window[-1] += time_delta
-        self.iteration += 1
-        return gain
\ No newline at end of file
+        return gain
@@ -0,0 +1,44 @@
+from pathlib import Path
+import json
+import time
+import yaml
+from analysis.benchmark import run_suite, save, compare
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+def get_config() -> dict:
+    path = PROJECT_ROOT / "config" / "config.yaml"
+    with path.open("r") as f:
+        config = yaml.safe_load(f)
+    return config
+
+def main():
+    config = get_config()
+    benchmark_config = config.get("benchmark", {})
+    report = run_suite(
+        config["analysis"],
+        benchmark_config.get("engines", ["cumulative_wealth_gain", "transaction_counting", "defi_transactions"]),
+        benchmark_config.get("generator", {}),
+    )
+    for result in report["results"]:
+        print(
+            f"{result['engine']:<30} Δ {str(result['delta']):>8}  "
+            f"p50 {result['p50_us']:10.1f} µs  p99 {result['p99_us']:10.1f} µs  "
+            f"{result['transfers_per_s']:12.0f} transfers/s  peak {result['peak_bytes'] / 2 ** 20:8.1f} MiB"
+        )
+
+    path = PROJECT_ROOT / benchmark_config.get("path", "data/benchmarks") / f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    save(report, path)
+    print(f"Saved {path}")
+
+    if benchmark_config.get("baseline"):
+        with (PROJECT_ROOT / benchmark_config["baseline"]).open("r") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, benchmark_config.get("regression_threshold", 0.1))
+        for engine, delta, metric, before, after in regressions:
+            print(f"Regression {engine} Δ {delta}: {metric} {before:.1f} -> {after:.1f}")
+        if not regressions:
+            print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
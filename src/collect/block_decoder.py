@@ -0,0 +1,134 @@
+from datetime import datetime
+
+# Pure block decoding. Nothing in here touches the network or the database, so it can run in a process pool.
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+TRANSFER_TOPIC = (
+    "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+)
+BIGINT_MAX = 2**63 - 1
+ASSET_PLATFORM = 'ethereum'
+
+TRANSACTION_COLUMNS = ["hash", "log_number", "block_number", "coin", "from_addr", "to_addr", "amount", "usd_value", "token_amount", "is_dex_swap"]
+
+
+def block_date(block):
+    return datetime.fromtimestamp(int(block["timestamp"], 16)).date()
+
+
+def token_amount(coin, amount):
+    return amount / (10 ** coin["decimals"])
+
+
+def usd_value(coin, amount, price):
+    # without a price the value is filled in later by DataCollector.price_transactions
+    if price is None:
+        return None
+    return token_amount(coin, amount) * price
+
+
+def decode_block(block, missing_coins, active_coins_dict, dex_swap, prices):
+    # prices maps (coin name, date) to the usd price of one token.
+    # returns the block number, its datetime and one row tuple per coin movement (see TRANSACTION_COLUMNS)
+    number = int(block["number"], 16)
+    datetime_block = datetime.fromtimestamp(int(block["timestamp"], 16))
+    date = datetime_block.date()
+
+    # coin movements grouped by transaction hash
+    movements = {}
+    dex_swaps = set()
+    coin = active_coins_dict.get(ASSET_PLATFORM, None)
+    if coin is not None and coin["name"] in missing_coins:
+        price = prices.get((coin["name"], date))
+        for tx in block["transactions"]:
+            if (tx["from"] is not None
+                    and tx["to"] is not None
+                        and tx["from"] != ZERO_ADDRESS
+                            and tx["to"] != ZERO_ADDRESS ):
+                value = int(tx["value"], 16)
+                movements.setdefault(tx["hash"], []).append(
+                    (
+                        tx["hash"],
+                        -1,
+                        number,
+                        coin["name"],
+                        tx["from"].lower(),
+                        tx["to"].lower(),
+                        min(value, BIGINT_MAX),
+                        usd_value(coin, value, price),
+                        token_amount(coin, value),
+                    )
+                )
+    # erc20
+    for receipt in block["receipts"]:
+        for log in receipt["logs"]:
+            topics = log.get("topics", [])
+
+            if not topics:
+                continue
+
+            event = topics[0].lower()
+
+            if event in dex_swap:
+                dex_swaps.add(log["transactionHash"])
+                break
+
+            if event == TRANSFER_TOPIC:
+                token_addr = log["address"].lower()
+                coin = active_coins_dict.get(token_addr)
+                if coin is None:
+                    continue  # not a tracked token
+
+                if coin["name"] not in missing_coins:
+                    continue  # coin has been tracked before
+
+                from_addr = "0x" + topics[1][-40:].lower()
+                to_addr   = "0x" + topics[2][-40:].lower()
+
+                if from_addr != ZERO_ADDRESS and to_addr != ZERO_ADDRESS:
+                    value = int(log["data"], 16)
+                    movements.setdefault(log["transactionHash"], []).append(
+                        (
+                            log["transactionHash"],
+                            int(log["logIndex"], 16),
+                            number,
+                            coin["name"],
+                            from_addr,
+                            to_addr,
+                            min(value, BIGINT_MAX),
+                            usd_value(coin, value, prices.get((coin["name"], date))),
+                            token_amount(coin, value),
+                        )
+                    )
+
+    transactions_in_block = []
+    for tx_hash, coin_movements_in_transaction in movements.items():
+        is_dex_swap = tx_hash in dex_swaps
+        transactions_in_block.extend(
+            movement + (is_dex_swap,)
+            for movement in coin_movements_in_transaction
+        )
+    return number, datetime_block, transactions_in_block
+
+
+def decode_blocks(blocks, missing_dict, active_coins_dict, dex_swap, prices):
+    # decodes a list of blocks into the rows of the blocks, block_ingestions and transactions tables
+    num_active_coins = len(active_coins_dict)
+    dex_swap = set(dex_swap)
+    blocks_in_batch = []
+    digests_in_batch = []
+    transactions_in_batch = []
+    for block in blocks:
+        missing_coins = missing_dict[int(block["number"], 16)]
+        number, datetime_block, transactions_in_block = decode_block(
+            block, missing_coins, active_coins_dict, dex_swap, prices
+        )
+        digestions = [
+            (number, val)
+            for val in missing_coins
+        ]
+        if len(digestions) == num_active_coins:
+            blocks_in_batch.append((number, datetime_block.isoformat()))
+        digests_in_batch.extend(digestions)
+        transactions_in_batch.extend(transactions_in_block)
+    return blocks_in_batch, digests_in_batch, transactions_in_batch
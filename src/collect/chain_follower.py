@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from collect.rpc_client import RPCError
+
+FOLLOW_SQL = """
+CREATE TABLE IF NOT EXISTS block_hashes (
+  "number"       BIGINT PRIMARY KEY,
+  "hash"         VARCHAR,
+  "parent_hash"  VARCHAR
+);
+"""
+
+
+class ChainFollower:
+    # Follows the chain head: polls eth_blockNumber, ingests every new block and feeds it into the running
+    # window algorithms. A block whose parentHash differs from the stored hash of its predecessor means a
+    # reorg, the orphaned blocks are removed from the database and reverted in the algorithms.
+    def __init__(
+        self,
+        dc,
+        algorithms,
+        cancellation_token,
+        poll_interval=1,
+        max_reorg_depth=64,
+        batch_size=100,
+        on_block=None,
+    ):
+        # algorithms maps a name to an instance with run_on_block/revert_last_block,
+        # created with a revert_depth of at least max_reorg_depth
+        self.dc = dc
+        self.algorithms = algorithms
+        self.cancellation_token = cancellation_token
+        self.poll_interval = poll_interval
+        self.max_reorg_depth = max_reorg_depth
+        self.batch_size = batch_size
+        self.on_block = on_block
+        self.active_coins = [x["name"] for x in dc.active_coins]
+        self.dc.db.execute(FOLLOW_SQL)
+        # number -> hash of the last max_reorg_depth ingested blocks
+        self.hashes = OrderedDict(
+            reversed(self.dc.db.execute(
+                "SELECT number, hash FROM block_hashes ORDER BY number DESC LIMIT ?",
+                (max_reorg_depth,),
+            ).fetchall())
+        )
+        # numbers of the blocks the algorithms have seen, newest last
+        self.fed = deque(maxlen=max_reorg_depth)
+        # seconds from the block timestamp to the updated metrics
+        self.latencies = []
+        self.next_block = None
+
+    def resume_block(self):
+        # the block after the last one followed in a previous run, None on the first run
+        if not self.hashes:
+            return None
+        return next(reversed(self.hashes)) + 1
+
+    async def get_head(self):
+        return int(await self.dc.rpc_client.rpc_call("eth_blockNumber", []), 16)
+
+    async def warm_up(self, start_block, end_block):
+        # fills the windows with [start_block, end_block) from the database, ingesting what is missing
+        for batch_start in range(start_block, end_block, self.batch_size):
+            if self.cancellation_token.is_canceled():
+                return
+            blocks = await self.dc.get_blocks(batch_start, min(batch_start + self.batch_size, end_block), False)
+            self.run_blocks(blocks, report=False)
+
+    async def follow(self, start_block):
+        self.next_block = start_block
+        numbers = None
+        while not self.cancellation_token.is_canceled():
+            try:
+                if numbers is None:
+                    head = await self.get_head()
+                    if head < self.next_block:
+                        await asyncio.sleep(self.poll_interval)
+                        continue
+                    end_block = min(head, self.next_block + self.batch_size - 1)
+                    numbers = list(range(self.next_block, end_block + 1))
+                await self.step(numbers)
+                numbers = None
+            except RPCError as e:
+                # e.g. a pooled node a few blocks behind the one that answered eth_blockNumber
+                print(f"Blocks {numbers[0]} to {numbers[-1]} not available yet, retrying: {e}" if numbers else f"No head block: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def step(self, numbers):
+        missing = await self.dc.get_missing(numbers, self.active_coins)
+        if missing:
+            # the raw cache is keyed by block number only, it would replay orphaned blocks after a reorg
+            missing_dict, gathered_blocks = await self.dc.fetch_missing(missing, use_cache=False)
+            gathered_blocks.sort(key=lambda block: int(block["number"], 16))
+
+            new_hashes = {}
+            for block in gathered_blocks:
+                number = int(block["number"], 16)
+                if number - 1 in new_hashes:
+                    if new_hashes[number - 1] != block["parentHash"]:
+                        # the node switched forks while answering, fetch the batch again
+                        return
+                elif self.hashes.get(number - 1, block["parentHash"]) != block["parentHash"]:
+                    await self.handle_reorg(number - 1)
+                    return
+                new_hashes[number] = block["hash"]
+
+            rows = await self.dc.decode_blocks(missing_dict, gathered_blocks)
+            checkpoint = (
+                "INSERT OR REPLACE INTO block_hashes SELECT unnest(?), unnest(?), unnest(?)",
+                (
+                    [int(block["number"], 16) for block in gathered_blocks],
+                    [block["hash"] for block in gathered_blocks],
+                    [block["parentHash"] for block in gathered_blocks],
+                ),
+            )
+            if not await self.dc.store_batch(rows, checkpoint):
+                # retried on the next poll
+                await asyncio.sleep(self.poll_interval)
+                return
+            self.hashes.update(new_hashes)
+            while len(self.hashes) > self.max_reorg_depth:
+                self.hashes.popitem(last=False)
+            self.dc.db.execute(
+                "DELETE FROM block_hashes WHERE number < ?",
+                (numbers[-1] - self.max_reorg_depth,),
+            )
+
+        blocks = await self.dc.get_blocks(numbers[0], numbers[-1] + 1, False)
+        self.run_blocks(blocks)
+        self.next_block = numbers[-1] + 1
+
+    def run_blocks(self, blocks, report=True):
+        for block in blocks:
+            test_block = {
+                "timestamp": block[1].timestamp(),
+                "transactions": block[2] if block[2] is not None else [],
+            }
+            results = {
+                name: algorithm.run_on_block(test_block)
+                for name, algorithm in self.algorithms.items()
+            }
+            self.fed.append(block[0])
+            if report:
+                latency = time.time() - test_block["timestamp"]
+                self.latencies.append(latency)
+                if self.on_block is not None:
+                    self.on_block(block[0], results, latency)
+
+    async def handle_reorg(self, number):
+        # block `number` is not canonical anymore, walk back to the last stored block that still is
+        fork_block = number
+        while fork_block - 1 in self.hashes:
+            canonical = await self.dc.rpc_client.rpc_call("eth_getBlockByNumber", [hex(fork_block - 1), False])
+            if canonical is None:
+                # nothing is rolled back yet, follow() retries the batch
+                raise RPCError(f"block {fork_block - 1} is not available on the node")
+            if canonical["hash"] == self.hashes[fork_block - 1]:
+                break
+            fork_block -= 1
+        if fork_block - 1 not in self.hashes and len(self.hashes) == self.max_reorg_depth:
+            print(f"Reorg deeper than {self.max_reorg_depth} blocks, rolling back to block {fork_block} only")
+        print(f"Reorg detected — rolling back blocks {fork_block} to {number}")
+
+        while self.fed and self.fed[-1] >= fork_block:
+            self.fed.pop()
+            for algorithm in self.algorithms.values():
+                algorithm.revert_last_block()
+        self.dc.rollback_from(fork_block, ("DELETE FROM block_hashes WHERE number >= ?", (fork_block,)))
+        for n in [n for n in self.hashes if n >= fork_block]:
+            del self.hashes[n]
+        self.next_block = min(self.next_block, fork_block)
@@ -0,0 +1,116 @@
+from collect.db_connection import open_db, is_compact, COMPACT_TABLES_SQL, TRANSACTIONS_VIEW_SQL
+
+# Writes and migration of the compact transactions layout (see COMPACT_SCHEMA_SQL).
+# Everything that only reads keeps using the hex "transactions" view.
+
+
+def ensure_coins(db, names):
+    db.execute(
+        """
+        INSERT INTO coins
+        SELECT
+            (SELECT coalesce(max(id), 0) FROM coins) + row_number() OVER (ORDER BY n.name),
+            n.name
+        FROM (SELECT DISTINCT name FROM unnest(?) AS u(name)) n
+        WHERE n.name NOT IN (SELECT name FROM coins)
+        """,
+        (list(names),),
+    )
+
+
+def intern_addresses(db, source):
+    # adds the from/to addresses of `source` (a table or registered DataFrame) that have no id yet
+    db.execute(
+        f"""
+        INSERT INTO addresses (address)
+        SELECT DISTINCT a.address
+        FROM (
+            SELECT unhex(substr(from_addr, 3)) AS address FROM {source}
+            UNION
+            SELECT unhex(substr(to_addr, 3)) FROM {source}
+        ) a
+        WHERE a.address NOT IN (SELECT address FROM addresses)
+        """
+    )
+
+
+def insert_transactions(db, tx_df):
+    # tx_df has the hex columns of collect.block_decoder.TRANSACTION_COLUMNS
+    db.register("tx_rows", tx_df)
+    try:
+        ensure_coins(db, tx_df["coin"].unique())
+        intern_addresses(db, "tx_rows")
+        db.execute(
+            """
+            INSERT INTO transactions_compact
+            SELECT
+                unhex(substr(t.hash, 3)),
+                t.log_number,
+                t.block_number,
+                c.id,
+                fa.id,
+                ta.id,
+                t.amount,
+                t.usd_value,
+                t.token_amount,
+                t.is_dex_swap
+            FROM tx_rows t
+            JOIN coins c      ON c.name = t.coin
+            JOIN addresses fa ON fa.address = unhex(substr(t.from_addr, 3))
+            JOIN addresses ta ON ta.address = unhex(substr(t.to_addr, 3))
+            """
+        )
+    finally:
+        db.unregister("tx_rows")
+
+
+def migrate_to_compact(db):
+    # moves an existing hex transactions table into the compact layout, in one transaction
+    if is_compact(db):
+        return
+    db.execute("BEGIN TRANSACTION")
+    try:
+        db.execute(COMPACT_TABLES_SQL)
+        db.execute(
+            """
+            INSERT INTO coins
+            SELECT row_number() OVER (ORDER BY coin), coin
+            FROM (SELECT DISTINCT coin FROM transactions)
+            """
+        )
+        intern_addresses(db, "transactions")
+        db.execute(
+            """
+            INSERT INTO transactions_compact
+            SELECT
+                unhex(substr(t.hash, 3)),
+                t.log_number,
+                t.block_number,
+                c.id,
+                fa.id,
+                ta.id,
+                t.amount,
+                t.usd_value,
+                t.token_amount,
+                t.is_dex_swap
+            FROM transactions t
+            JOIN coins c      ON c.name = t.coin
+            JOIN addresses fa ON fa.address = unhex(substr(t.from_addr, 3))
+            JOIN addresses ta ON ta.address = unhex(substr(t.to_addr, 3))
+            """
+        )
+        db.execute("DROP INDEX IF EXISTS idx_coin")
+        db.execute("DROP TABLE transactions")
+        db.execute(TRANSACTIONS_VIEW_SQL)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    # DuckDB reuses the freed blocks, copy the database (EXPORT/IMPORT DATABASE) to shrink the file itself
+    db.execute("CHECKPOINT")
+
+
+if __name__ == "__main__":
+    con = open_db()
+    migrate_to_compact(con)
+    print("DB migrated to the compact layout.")
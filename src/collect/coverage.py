@@ -0,0 +1,134 @@
+COVERAGE_SQL = """
+CREATE TABLE IF NOT EXISTS block_coverage (
+  "coin"         VARCHAR,
+  "start_block"  BIGINT,
+  "end_block"    BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS idx_block_coverage ON block_coverage(coin, end_block);
+"""
+
+
+def merge_ranges(ranges):
+    # merges overlapping and adjacent inclusive [start, end] ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def uncovered(ranges, lo, hi):
+    # the gaps of the sorted, merged ranges within [lo, hi]
+    gaps = []
+    position = lo
+    for start, end in ranges:
+        if start > position:
+            gaps.append((position, min(start - 1, hi)))
+        position = max(position, end + 1)
+        if position > hi:
+            break
+    if position <= hi:
+        gaps.append((position, hi))
+    return gaps
+
+
+class BlockCoverage:
+    # Ingested blocks per coin as contiguous [start_block, end_block] ranges instead of one
+    # block_ingestions row per (block, coin). Gap detection is a range query that is O(#ranges).
+    def __init__(self, db, read_only=False):
+        self.db = db
+        if not read_only:
+            self.db.execute(COVERAGE_SQL)
+            self.migrate()
+
+    def migrate(self):
+        # builds the ranges once from an existing block_ingestions table
+        if self.db.execute("SELECT count(*) FROM block_coverage").fetchone()[0] > 0:
+            return
+        self.db.execute(
+            """
+            INSERT INTO block_coverage
+            SELECT coin, min(block_number), max(block_number)
+            FROM (
+                SELECT
+                    coin,
+                    block_number,
+                    block_number - row_number() OVER (PARTITION BY coin ORDER BY block_number) AS island
+                FROM block_ingestions
+            )
+            GROUP BY coin, island
+            """
+        )
+
+    def get_ranges(self, coin, lo, hi):
+        # all ranges touching [lo, hi]
+        return [
+            [start, end]
+            for start, end in self.db.execute(
+                """
+                SELECT start_block, end_block
+                FROM block_coverage
+                WHERE coin = ? AND end_block >= ? AND start_block <= ?
+                ORDER BY start_block
+                """,
+                (coin, lo, hi),
+            ).fetchall()
+        ]
+
+    def summary(self):
+        # {coin: ranges} of the whole database, empty if it has no coverage yet
+        if self.db.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'block_coverage'").fetchone()[0] == 0:
+            return {}
+        summary = {}
+        for coin, start, end in self.db.execute(
+            "SELECT coin, start_block, end_block FROM block_coverage ORDER BY coin, start_block"
+        ).fetchall():
+            summary.setdefault(coin, []).append([start, end])
+        return {coin: merge_ranges(ranges) for coin, ranges in summary.items()}
+
+    def add(self, digests):
+        # digests are (block_number, coin) pairs, merged into the existing ranges on insert
+        runs = {}
+        for number, coin in digests:
+            runs.setdefault(coin, []).append([number, number])
+        for coin, coin_runs in runs.items():
+            coin_runs = merge_ranges(coin_runs)
+            lo = coin_runs[0][0] - 1
+            hi = coin_runs[-1][1] + 1
+            merged = merge_ranges(self.get_ranges(coin, lo, hi) + coin_runs)
+            self.db.execute(
+                "DELETE FROM block_coverage WHERE coin = ? AND end_block >= ? AND start_block <= ?",
+                (coin, lo, hi),
+            )
+            self.db.executemany(
+                "INSERT INTO block_coverage VALUES (?, ?, ?)",
+                [(coin, start, end) for start, end in merged],
+            )
+
+    def remove_from(self, block_number):
+        # forgets everything from block_number on, e.g. after a reorg
+        self.db.execute("DELETE FROM block_coverage WHERE start_block >= ?", (block_number,))
+        self.db.execute(
+            "UPDATE block_coverage SET end_block = ? WHERE end_block >= ?",
+            (block_number - 1, block_number),
+        )
+
+    def missing(self, current_blocks, coins):
+        # same result as the old block_ingestions anti join: [(block_number, [missing coins])] ordered by block
+        if len(current_blocks) == 0:
+            return []
+        lo = min(current_blocks)
+        hi = max(current_blocks)
+        missing = {}
+        requested = None
+        for coin in sorted(coins):
+            for start, end in uncovered(self.get_ranges(coin, lo, hi), lo, hi):
+                if requested is None:
+                    requested = set(current_blocks)
+                for number in range(start, end + 1):
+                    if number in requested:
+                        missing.setdefault(number, []).append(coin)
+        return sorted(missing.items())
@@ -1,61 +1,147 @@
 from decimal import Decimal
 from pathlib import Path
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
-from collect.db_connection import open_db
+from collect.db_connection import open_db, is_compact
+from collect.compact_storage import migrate_to_compact, insert_transactions
 from coingecko_sdk import Coingecko
-from collect.rpc_client import RPCClient
+from collect.rpc_client import RPCClient, RPCError
+from collect.price_prefetch import PricePrefetcher, COINGECKO_DEMO_URL
+from collect.raw_cache import RawBlockCache
+from collect.coverage import BlockCoverage, uncovered
+from collect.parquet_archive import archived_sources
 import pandas as pd
 from eth_utils import keccak, event_signature_to_log_topic
 import numpy as np
+from collect.block_decoder import (
+    TRANSFER_TOPIC,
+    ASSET_PLATFORM,
+    TRANSACTION_COLUMNS,
+    block_date,
+    decode_blocks,
+)
 
-ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 DB_PATH = PROJECT_ROOT / "data" / "main.duckdb"
-TRANSFER_TOPIC = (
-    "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
-)
-BIGINT_MAX = 2**63 - 1
 
-ASSET_PLATFORM = 'ethereum'
 ETH_NAME ="ETH"
 
 class DataCollector:
     def __init__(
         self,
         config: dict,
+        open_database: bool = True,
+        read_only: bool = False,
     ):
+        # without a database the collector can only fetch and decode, e.g. in parallel backfill workers.
+        # read_only is for analysis: the analysis_db snapshot is opened read only and the coverage is
+        # trusted, there is no RPC or CoinGecko client and nothing is ever fetched
         self.config = config
-        self.rpc_client = RPCClient(
-            rpc_url=config["RCP_URL"]
-            )
-        self.coin_gecko = Coingecko(
-            demo_api_key=config["COIN_GECKO_API_KEY"],
-            environment="demo"
-            )
+        self.read_only = read_only
+        if read_only:
+            self.rpc_client = None
+            self.coin_gecko = None
+        else:
+            rpc_config = config.get("rpc", {})
+            cache_config = config.get("raw_cache", {})
+            raw_cache = None
+            if cache_config.get("enabled", False):
+                raw_cache = RawBlockCache(
+                    PROJECT_ROOT / cache_config.get("path", "data/raw_cache"),
+                    level=cache_config.get("level", 3),
+                )
+            self.rpc_client = RPCClient(
+                # several archive nodes can be given comma separated
+                rpc_url=[url.strip() for url in config["RCP_URL"].split(",")],
+                batch_size=rpc_config.get("batch_size", 50),
+                max_in_flight=rpc_config.get("max_in_flight", 8),
+                max_retries=rpc_config.get("max_retries", 5),
+                backoff=rpc_config.get("backoff", 0.5),
+                timeout=rpc_config.get("timeout", 60),
+                pool_config=rpc_config.get("pool"),
+                cache=raw_cache,
+                )
+            self.coin_gecko = Coingecko(
+                demo_api_key=config["COIN_GECKO_API_KEY"],
+                environment="demo"
+                )
         self.dex_swap = [
             "0x"+event_signature_to_log_topic(x).hex()
             for x in config["dex_events"]
         ]
-        self.db = open_db()
+        ingestion_config = config.get("ingestion", {})
+        # "receipts" downloads all receipts of a block, "logs" only the tracked events via eth_getLogs
+        self.ingestion_mode = ingestion_config.get("mode", "receipts")
+        self.logs_range = ingestion_config.get("logs_range", 100)
+        # 0 decodes on the event loop, otherwise in a pool of that many processes
+        self.decode_processes = ingestion_config.get("decode_processes", 0)
+        self.decode_executor = None
+        # store raw amounts only and value whole batches in one UPDATE against coin_values
+        self.defer_usd = ingestion_config.get("defer_usd", False)
+        archive_config = config.get("archive", {})
+        # days compacted out of the database are read back from the Parquet archive by get_blocks
+        self.archive_path = None
+        if archive_config.get("compact_hot", False):
+            self.archive_path = PROJECT_ROOT / archive_config.get("path", "data/archive")
+        self.db = None
+        self.compact = False
+        self.coverage = None
+        self.coverage_summary = None
+        self.gaps_reported = False
+        if open_database and read_only:
+            self.db = open_db(PROJECT_ROOT / config.get("analysis_db", {}).get("path", "data/analysis.duckdb"), read_only=True)
+            self.compact = is_compact(self.db)
+            self.coverage = BlockCoverage(self.db, read_only=True)
+            self.coverage_summary = self.coverage.summary()
+        elif open_database:
+            self.db = open_db()
+            if config.get("storage", {}).get("compact", False):
+                migrate_to_compact(self.db)
+            # a migrated database stays compact, whatever the config says
+            self.compact = is_compact(self.db)
+            self.coverage = BlockCoverage(self.db)
         self.price_data = {}
         self.active_coins = list(filter(lambda x: x["active"] == True, self.config["token"]))
         self.active_coins_dict = {
             coin["address"].lower(): coin
             for coin in self.active_coins
         }
+        self.coins_by_name = {
+            coin["name"]: coin
+            for coin in self.config["token"]
+        }
         self.num_active_coins = len(self.active_coins)
         self.current_prices = {}
         self.current_date = datetime.min
 
     async def open(self):
-        await self.rpc_client.open()
+        if self.rpc_client is not None:
+            await self.rpc_client.open()
+        if self.decode_processes > 0 and self.decode_executor is None:
+            self.decode_executor = ProcessPoolExecutor(max_workers=self.decode_processes)
 
     async def close(self):
-        await self.rpc_client.close()
-        self.db.close()
+        if self.rpc_client is not None:
+            await self.rpc_client.close()
+        if self.decode_executor is not None:
+            self.decode_executor.shutdown()
+            self.decode_executor = None
+        if self.db is not None:
+            self.db.close()
 
     async def make_blocks_in_db_available(self, start_block, end_block):
+        if self.read_only:
+            # never fetches, gaps in the snapshot are only reported
+            gaps = {
+                coin["name"]: uncovered(self.coverage_summary.get(coin["name"], []), start_block, end_block - 1)
+                for coin in self.active_coins
+            }
+            gaps = {coin: ranges for coin, ranges in gaps.items() if ranges}
+            if gaps and not self.gaps_reported:
+                self.gaps_reported = True
+                print(f"Blocks missing in the analysis database, they are analysed without those coins: {gaps}")
+            return
        # check if coins are in database
         active_coins = [x["name"] for x in self.active_coins]
         current_blocks = list(range(start_block, end_block))
@@ -65,11 +151,27 @@ class DataCollector:
         if len(missing) != 0:
             await self.fetch_and_add_missing_to_db(missing)
 
-    async def get_blocks(self, start_block, end_block, with_dex = False):
+    async def get_blocks(self, start_block, end_block, with_dex = False, hex_addresses = True):
         await self.make_blocks_in_db_available(start_block, end_block)
+        blocks = "blocks"
+        source = "transactions"
+        archived = None
+        if self.archive_path is not None:
+            archived = archived_sources(self.db, self.archive_path, start_block, end_block)
+        if archived is not None:
+            # the archive has hex hashes and addresses only
+            blocks, source = archived
+        elif self.compact and not hex_addresses:
+            # integer address ids and BLOB hashes, no hex decoding
+            source = """(
+                SELECT t.hash, t.block_number, c.name AS coin, t.from_id AS from_addr, t.to_id AS to_addr,
+                       t.amount, t.usd_value, t.is_dex_swap
+                FROM transactions_compact t
+                JOIN coins c ON c.id = t.coin_id
+            )"""
         if with_dex:
             return self.db.execute(
-                """
+                f"""
                 SELECT
                   b.number,
                   b.timestamp,
@@ -87,8 +189,8 @@ class DataCollector:
                     ) FILTER (WHERE t.hash IS NOT NULL),
                     []                   
                   ) AS transactions
-                FROM blocks b
-                LEFT JOIN transactions t
+                FROM {blocks} b
+                LEFT JOIN {source} t
                   ON t.block_number = b.number
                 WHERE b.number BETWEEN ? AND ?
                 GROUP BY b.number, b.timestamp
@@ -97,7 +199,7 @@ class DataCollector:
                 (start_block, end_block - 1)
             ).fetchall()
         return self.db.execute(
-            """
+            f"""
             SELECT
               b.number,
               b.timestamp,
@@ -115,8 +217,8 @@ class DataCollector:
                 ) FILTER (WHERE t.hash IS NOT NULL),
                 []
               ) AS transactions
-            FROM blocks b
-            LEFT JOIN transactions t
+            FROM {blocks} b
+            LEFT JOIN {source} t
               ON t.block_number = b.number
              AND coalesce(t.is_dex_swap, false) = false
             WHERE b.number BETWEEN ? AND ?
@@ -126,41 +228,217 @@ class DataCollector:
             (start_block, end_block - 1),
         ).fetchall()
 
-    async def get_missing(self,current_blocks, active_coins):
-        return self.db.execute(
-            """
-            WITH expected AS (
-                SELECT
-                    b.block_number,
-                    c.coin
-                FROM unnest(?) AS b(block_number)
-                CROSS JOIN unnest(?) AS c(coin)
+    async def get_defi_values(self, start_block, end_block, with_dex = False):
+        # DefiTransactions.block_value of every block in [start_block, end_block) as one aggregation:
+        # the positive net flows per (block, hash, address), summed per block. Blocks without value are left out
+        await self.make_blocks_in_db_available(start_block, end_block)
+        archived = None
+        if self.archive_path is not None:
+            archived = archived_sources(self.db, self.archive_path, start_block, end_block)
+        if archived is not None:
+            # the archive has hex hashes and addresses only
+            source = archived[1]
+            from_addr, to_addr = "from_addr", "to_addr"
+        elif self.compact:
+            source = "transactions_compact"
+            from_addr, to_addr = "from_id", "to_id"
+        else:
+            source = "transactions"
+            from_addr, to_addr = "from_addr", "to_addr"
+        rows = self.db.execute(
+            f"""
+            WITH flows AS (
+                SELECT block_number, hash, {from_addr} AS address, usd_value AS value
+                FROM {source}
+                WHERE block_number BETWEEN ? AND ?
+                  AND usd_value IS NOT NULL
+                  AND {from_addr} <> {to_addr}
+                  {"" if with_dex else "AND coalesce(is_dex_swap, false) = false"}
+                UNION ALL
+                SELECT block_number, hash, {to_addr}, -usd_value
+                FROM {source}
+                WHERE block_number BETWEEN ? AND ?
+                  AND usd_value IS NOT NULL
+                  AND {from_addr} <> {to_addr}
+                  {"" if with_dex else "AND coalesce(is_dex_swap, false) = false"}
             ),
-            missing AS (
-                SELECT
-                    e.block_number,
-                    e.coin
-                FROM expected e
-                LEFT JOIN block_ingestions bi
-                  ON bi.block_number = e.block_number
-                 AND bi.coin = e.coin
-                WHERE bi.block_number IS NULL
+            net AS (
+                SELECT block_number, sum(value) AS value
+                FROM flows
+                GROUP BY block_number, hash, address
             )
-            SELECT
-                block_number,
-                list(coin ORDER BY coin) AS missing_coins
-            FROM missing
+            SELECT block_number, sum(value)
+            FROM net
+            WHERE value > 0
             GROUP BY block_number
-            ORDER BY block_number;
             """,
-            (current_blocks, active_coins)
+            (start_block, end_block - 1, start_block, end_block - 1),
         ).fetchall()
+        return dict(rows)
+
+    async def get_volume_windows(self, start_block, end_block, deltas, with_dex = False):
+        # the TransactionCounting series of every delta over [start_block, end_block) in one query:
+        # the volume per block, summed over the blocks of the last delta seconds with a RANGE window.
+        # Returns the block timestamps and a (len(deltas), blocks) array
+        await self.make_blocks_in_db_available(start_block, end_block)
+        windows = ",\n".join(
+            f"""sum(volume) OVER (
+                    ORDER BY timestamp
+                    RANGE BETWEEN INTERVAL {int(delta)} SECOND PRECEDING AND CURRENT ROW
+                ) AS window_{i}"""
+            for i, delta in enumerate(deltas)
+        )
+        columns = self.db.execute(
+            f"""
+            WITH volumes AS (
+                SELECT b.timestamp, coalesce(sum(t.usd_value), 0) AS volume
+                FROM blocks b
+                LEFT JOIN transactions t
+                  ON t.block_number = b.number
+                 {"" if with_dex else "AND coalesce(t.is_dex_swap, false) = false"}
+                WHERE b.number BETWEEN ? AND ?
+                GROUP BY b.number, b.timestamp
+            )
+            SELECT timestamp, {windows}
+            FROM volumes
+            ORDER BY timestamp
+            """,
+            (start_block, end_block - 1),
+        ).fetchnumpy()
+        return columns["timestamp"], np.vstack([
+            np.asarray(columns[f"window_{i}"], dtype=np.float64)
+            for i in range(len(deltas))
+        ])
+
+    def _transaction_source(self):
+        if self.compact:
+            return "transactions_compact", "from_id", "to_id"
+        return "transactions", "from_addr", "to_addr"
+
+    async def get_block_columns(self, start_block, end_block, with_dex = False):
+        # the blocks of [start_block, end_block) as NumPy columns instead of rows of transaction dicts:
+        #   timestamp   (blocks,) block timestamps, seconds since the epoch
+        #   offsets     (blocks + 1,) transactions of block i are offsets[i]:offsets[i + 1]
+        #   hash_ids, from_ids, to_ids, usd_value   (transactions,) dense integer ids, NaN for unpriced
+        await self.make_blocks_in_db_available(start_block, end_block)
+        source, from_addr, to_addr = self._transaction_source()
+        # numbered in address order, so that both joins of the subquery get the same ids
+        addresses = f"""(
+            SELECT address, row_number() OVER (ORDER BY address) - 1 AS id
+            FROM (
+                SELECT {from_addr} AS address FROM {source} WHERE block_number BETWEEN {int(start_block)} AND {int(end_block) - 1}
+                UNION
+                SELECT {to_addr} FROM {source} WHERE block_number BETWEEN {int(start_block)} AND {int(end_block) - 1}
+            )
+        )"""
+        return self._block_columns(start_block, end_block, with_dex, addresses)
+
+    async def iter_block_columns(self, start_block, end_block, with_dex = False, chunk_blocks = 10000):
+        # get_block_columns in chunks of at most chunk_blocks blocks, so that memory stays flat for any range.
+        # Address ids are the same in all chunks: they come from a temporary table of the range's addresses
+        # that stays in DuckDB, only one chunk of columns is held in Python at a time
+        await self.make_blocks_in_db_available(start_block, end_block)
+        source, from_addr, to_addr = self._transaction_source()
+        self.db.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE column_addresses AS
+            SELECT address, row_number() OVER (ORDER BY address) - 1 AS id
+            FROM (
+                SELECT {from_addr} AS address FROM {source} WHERE block_number BETWEEN ? AND ?
+                UNION
+                SELECT {to_addr} FROM {source} WHERE block_number BETWEEN ? AND ?
+            )
+            """,
+            (start_block, end_block - 1, start_block, end_block - 1),
+        )
+        try:
+            for chunk_start in range(start_block, end_block, chunk_blocks):
+                yield self._block_columns(chunk_start, min(chunk_start + chunk_blocks, end_block), with_dex, "column_addresses")
+        finally:
+            self.db.execute("DROP TABLE IF EXISTS column_addresses")
+
+    def _block_columns(self, start_block, end_block, with_dex, addresses):
+        # addresses: table or subquery of (address, id)
+        source, from_addr, to_addr = self._transaction_source()
+        blocks = self.db.execute(
+            """
+            SELECT number, epoch(timestamp) AS timestamp
+            FROM blocks
+            WHERE number BETWEEN ? AND ?
+            ORDER BY timestamp
+            """,
+            (start_block, end_block - 1),
+        ).fetchnumpy()
+        transactions = self.db.execute(
+            f"""
+            SELECT
+              tx.block_number,
+              dense_rank() OVER (ORDER BY tx.hash) - 1 AS hash_id,
+              f.id AS from_id,
+              t.id AS to_id,
+              coalesce(tx.usd_value, 'NaN'::DOUBLE) AS usd_value
+            FROM {source} tx
+            JOIN {addresses} f ON f.address = tx.{from_addr}
+            JOIN {addresses} t ON t.address = tx.{to_addr}
+            WHERE tx.block_number BETWEEN ? AND ?
+              {"" if with_dex else "AND coalesce(tx.is_dex_swap, false) = false"}
+            ORDER BY tx.block_number
+            """,
+            (start_block, end_block - 1),
+        ).fetchnumpy()
+        numbers = np.asarray(blocks["number"], dtype=np.int64)
+        tx_blocks = np.asarray(transactions["block_number"], dtype=np.int64)
+        return {
+            "timestamp": np.asarray(blocks["timestamp"], dtype=np.float64),
+            "offsets": np.append(np.searchsorted(tx_blocks, numbers), len(tx_blocks)).astype(np.int64),
+            "hash_ids": np.asarray(transactions["hash_id"], dtype=np.int64),
+            "from_ids": np.asarray(transactions["from_id"], dtype=np.int64),
+            "to_ids": np.asarray(transactions["to_id"], dtype=np.int64),
+            "usd_value": np.asarray(transactions["usd_value"], dtype=np.float64),
+        }
+
+    async def get_missing(self,current_blocks, active_coins):
+        return self.coverage.missing(current_blocks, active_coins)
+
+    async def get_block_datetime(self, block_number):
+        row = self.db.execute(
+            "SELECT timestamp FROM blocks WHERE number = ?",
+            (block_number,),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        block = await self.rpc_client.rpc_call("eth_getBlockByNumber", [hex(block_number), False])
+        if block is None:
+            raise RPCError(f"block {block_number} is not produced yet")
+        return datetime.fromtimestamp(int(block["timestamp"], 16))
+
+    async def prefetch_prices(self, start_block, end_block):
+        # loads all missing daily prices of the active coins for the dates spanned by the block range
+        price_config = self.config.get("prices", {})
+        start_date = (await self.get_block_datetime(start_block)).date()
+        try:
+            end_date = (await self.get_block_datetime(end_block)).date()
+        except RPCError:
+            # end_block is not produced yet
+            end_date = datetime.now().date()
+        prefetcher = PricePrefetcher(
+            self.db,
+            self.config["COIN_GECKO_API_KEY"],
+            base_url=price_config.get("base_url", COINGECKO_DEMO_URL),
+            calls_per_minute=price_config.get("calls_per_minute", 30),
+            max_concurrency=price_config.get("max_concurrency", 4),
+        )
+        return await prefetcher.prefetch(self.active_coins, start_date, end_date)
+
     async def get_usd_value(self, coin, datetime_of_block, amount):
-        date = datetime_of_block.date()
+        price = await self.get_price(coin, datetime_of_block.date())
+        return np.float64(amount * price / (10 ** coin["decimals"]))
+
+    async def get_price(self, coin, date):
         if self.current_date == date:
             price = self.current_prices.get(coin["name"])
             if price is not None:
-                return np.float64(amount * price / (10 ** coin["decimals"]))
+                return price
 
         row = self.db.execute(
             """
@@ -191,7 +469,7 @@ class DataCollector:
             rows_to_insert = [
                 (
                     coin["name"],
-                    datetime_of_block.fromtimestamp(price[0] / 1000).date().isoformat(),
+                    datetime.fromtimestamp(price[0] / 1000).date().isoformat(),
                     price[1]
                 )
                 for price in resp.prices
@@ -206,121 +484,226 @@ class DataCollector:
                     """,
                     rows_to_insert,
                 )
-                row = rows_to_insert[0]
+                # the last sample of the day, as stored, the first one if CoinGecko has none of that day
+                row = next(
+                    (r for r in reversed(rows_to_insert) if r[1] == date.isoformat()),
+                    rows_to_insert[0],
+                )
 
+        if self.current_date != date:
+            self.current_prices = {}
         self.current_date = date
         self.current_prices[coin["name"]] = row[2]
-        return np.float64(amount * row[2] / (10 ** coin["decimals"]))
+        return row[2]
+
+    async def fetch_blocks_with_logs(self, missing_dict):
+        # eth_getLogs over contiguous block ranges instead of all receipts. Only the tracked token transfers and
+        # the dex events are requested, full blocks only where native ETH still has to be ingested
+        numbers = sorted(missing_dict)
+        eth = self.active_coins_dict.get(ASSET_PLATFORM, None)
+        full_transactions = [
+            eth is not None and eth["name"] in missing_dict[number]
+            for number in numbers
+        ]
+        block_ranges = []
+        for number in numbers:
+            if (block_ranges
+                    and block_ranges[-1][1] == number - 1
+                        and number - block_ranges[-1][0] < self.logs_range):
+                block_ranges[-1][1] = number
+            else:
+                block_ranges.append([number, number])
+
+        token_addresses = [
+            address for address in self.active_coins_dict
+            if address != ASSET_PLATFORM
+        ]
+        tasks = [self.rpc_client.get_blocks(numbers, full_transactions)]
+        if token_addresses:
+            tasks.append(self.rpc_client.get_logs(block_ranges, {
+                "address": token_addresses,
+                "topics": [[TRANSFER_TOPIC]],
+            }))
+        if self.dex_swap:
+            tasks.append(self.rpc_client.get_logs(block_ranges, {
+                "topics": [self.dex_swap],
+            }))
+        gathered = await asyncio.gather(*tasks)
+        blocks = gathered[0]
+
+        # rebuild receipt-like log lists so that logs-mode and receipts-mode decode identically
+        logs_by_block = {}
+        for logs in gathered[1:]:
+            for log in logs:
+                if log.get("removed"):
+                    continue
+                txs = logs_by_block.setdefault(int(log["blockNumber"], 16), {})
+                txs.setdefault(log["transactionHash"], []).append(log)
+        for block in blocks:
+            txs = logs_by_block.get(int(block["number"], 16), {})
+            block["receipts"] = [
+                {
+                    "transactionHash": tx_hash,
+                    "logs": sorted(logs, key=lambda log: int(log["logIndex"], 16)),
+                }
+                for tx_hash, logs in txs.items()
+            ]
+        return blocks
 
     async def fetch_and_add_missing_to_db(self, missing):
+        missing_dict, gathered_blocks = await self.fetch_missing(missing)
+        rows = await self.decode_blocks(missing_dict, gathered_blocks)
+        await self.store_batch(rows)
+
+    async def fetch_missing(self, missing, use_cache=True):
+        # use_cache=False skips the raw block cache, e.g. for head blocks that can still be reorged
         missing_dict = {
             m[0]: m[1]
             for m in missing
         }
-        tasks = [self.rpc_client.process_block(b[0]) for b in missing]
-        gathered_blocks = await asyncio.gather(*tasks)
-
-        blocks_in_batch = []
-        digests_in_batch = []
-        transactions_in_batch = []
-        for i, block in enumerate(gathered_blocks):
-            number = int(block["number"], 16)
-            datetime_block = datetime.fromtimestamp(int(block["timestamp"], 16))
-
-            transactions_in_block = []
-            for transaction in zip(block["transactions"], block["receipts"]):
-                was_dex_swap = False
-                coin_movements_in_transaction = []
-                coin = self.active_coins_dict.get(ASSET_PLATFORM, None)
-                if coin is not None and coin["name"] in missing_dict[number]:
-                    tx = transaction[0]
-                    if (tx["from"] is not None
-                            and tx["to"] is not None
-                                and tx["from"] != ZERO_ADDRESS
-                                    and tx["to"] != ZERO_ADDRESS ):
-                        coin_movements_in_transaction.append(
-                            [
-                                tx["hash"],
-                                -1,
-                                number,
-                                coin["name"],
-                                tx["from"].lower(),
-                                tx["to"].lower(),
-                                min(int(tx["value"], 16),BIGINT_MAX), 
-                                await self.get_usd_value(coin, datetime_block, int(tx["value"], 16), ),
-                                False
-                            ]
-                        )
-                # erc20
-                for log in transaction[1]["logs"]:
-                    topics = log.get("topics", [])
-
-                    if not topics:
-                        continue
-
-                    event = topics[0].lower()
-
-                    if event in self.dex_swap:
-                        was_dex_swap = True
-                        break
-
-                    if event == TRANSFER_TOPIC:
-                        token_addr = log["address"].lower()
-                        coin = self.active_coins_dict.get(token_addr)
-                        if coin is None:
-                            continue  # not a tracked token
-
-                        if coin["name"] not in missing_dict[number]:
-                            continue  # coin has been tracked before
-
-                        from_addr = "0x" + topics[1][-40:].lower()
-                        to_addr   = "0x" + topics[2][-40:].lower()
-
-                        if from_addr != ZERO_ADDRESS and to_addr != ZERO_ADDRESS:
-                            coin_movements_in_transaction.append(
-                                [
-                                    log["transactionHash"],
-                                    int(log["logIndex"], 16),
-                                    number,
-                                    coin["name"],
-                                    from_addr,
-                                    to_addr,
-                                    min(int(log["data"], 16),BIGINT_MAX),
-                                    await self.get_usd_value(coin, datetime_block, int(log["data"], 16)),
-                                    False,
-                                ]
-                            )
-                            if coin_movements_in_transaction[-1][6] > BIGINT_MAX:
-                                print("value too big")
-                if  was_dex_swap:
-                    for tx in coin_movements_in_transaction:
-                        tx[8] = True
-                transactions_in_block.extend(coin_movements_in_transaction)
-            digestions = [
-                (number, val)
-                for val in missing[i][1]
-            ]
-            if len(digestions) == self.num_active_coins:
-                blocks_in_batch.append((number, datetime_block.isoformat()))
-            digests_in_batch.extend(digestions)
-            if len(transactions_in_block) > 0:
-                transactions_in_batch.extend(transactions_in_block)
+        if self.ingestion_mode == "logs":
+            gathered_blocks = await self.fetch_blocks_with_logs(missing_dict)
+        else:
+            gathered_blocks = await self.rpc_client.process_blocks([b[0] for b in missing], use_cache)
+        return missing_dict, gathered_blocks
+
+    async def get_prices(self, missing_dict, gathered_blocks):
+        # prices are resolved on the event loop, decoding only gets the (coin, date) -> price table
+        prices = {}
+        for block in gathered_blocks:
+            date = block_date(block)
+            for coin in self.active_coins:
+                key = (coin["name"], date)
+                if key not in prices and coin["name"] in missing_dict[int(block["number"], 16)]:
+                    prices[key] = await self.get_price(coin, date)
+        return prices
+
+    async def decode_blocks(self, missing_dict, gathered_blocks):
+        if self.defer_usd:
+            prices = {}
+        else:
+            prices = await self.get_prices(missing_dict, gathered_blocks)
+        if self.decode_executor is None:
+            return decode_blocks(gathered_blocks, missing_dict, self.active_coins_dict, self.dex_swap, prices)
+
+        # split the batch so every process gets a share
+        loop = asyncio.get_running_loop()
+        chunk_size = -(-len(gathered_blocks) // self.decode_processes)
+        chunks = [
+            gathered_blocks[i:i + chunk_size]
+            for i in range(0, len(gathered_blocks), chunk_size)
+        ]
+        results = await asyncio.gather(*[
+            loop.run_in_executor(
+                self.decode_executor,
+                decode_blocks,
+                chunk,
+                {int(block["number"], 16): missing_dict[int(block["number"], 16)] for block in chunk},
+                self.active_coins_dict,
+                self.dex_swap,
+                prices,
+            )
+            for chunk in chunks
+        ])
+        return tuple(
+            [row for result in results for row in result[i]]
+            for i in range(3)
+        )
+
+    async def store_batch(self, rows, checkpoint=None):
+        written = self.write_batch(rows, checkpoint)
+        digests_in_batch = rows[1]
+        if written and self.defer_usd and digests_in_batch:
+            await self.price_transactions(
+                min(d[0] for d in digests_in_batch),
+                max(d[0] for d in digests_in_batch),
+            )
+        return written
 
+    async def price_transactions(self, start_block, end_block, reprice=False):
+        # fills usd_value of all transactions in [start_block, end_block] with one set based UPDATE.
+        # With reprice=True already valued transactions are recomputed, e.g. after correcting coin_values
+        gaps = self.db.execute(
+            """
+            SELECT DISTINCT t.coin, CAST(b.timestamp AS DATE) AS date
+            FROM transactions t
+            JOIN blocks b
+              ON b.number = t.block_number
+            LEFT JOIN coin_values cv
+              ON cv.coin = t.coin
+             AND cv.date = CAST(b.timestamp AS DATE)
+            WHERE t.block_number BETWEEN ? AND ?
+              AND cv.coin IS NULL
+            ORDER BY date
+            """,
+            (start_block, end_block),
+        ).fetchall()
+        for coin_name, date in gaps:
+            await self.get_price(self.coins_by_name[coin_name], date)
+
+        if self.compact:
+            table = "transactions_compact"
+            coin = "c.name"
+        else:
+            table = "transactions"
+            coin = "t.coin"
+        self.db.execute(
+            f"""
+            UPDATE {table} AS t
+            SET usd_value = t.token_amount * cv.usd_value
+            FROM blocks b, coin_values cv {", coins c" if self.compact else ""}
+            WHERE b.number = t.block_number
+              AND cv.coin = {coin}
+              {"AND c.id = t.coin_id" if self.compact else ""}
+              AND cv.date = CAST(b.timestamp AS DATE)
+              AND t.block_number BETWEEN ? AND ?
+              AND t.token_amount IS NOT NULL
+              {"" if reprice else "AND t.usd_value IS NULL"}
+            """,
+            (start_block, end_block),
+        )
+
+    def write_batch(self, rows, checkpoint=None):
+        # checkpoint is an optional (sql, params) statement committed together with the batch
+        blocks_in_batch, digests_in_batch, transactions_in_batch = rows
         blocks_df = pd.DataFrame(blocks_in_batch, columns=["number", "timestamp"])
-        digests_df = pd.DataFrame(digests_in_batch, columns=["block_number", "coin"])
-        tx_df = pd.DataFrame(transactions_in_batch, columns=["hash", "log_number","block_number", "coin", "from_addr", "to_addr", "amount", "usd_value", "is_dex_swap"])
+        tx_df = pd.DataFrame(transactions_in_batch, columns=TRANSACTION_COLUMNS)
         try:
             self.db.execute("BEGIN TRANSACTION")
             if not blocks_df.empty:
-                self.db.execute("INSERT INTO blocks SELECT number, timestamp FROM blocks_df")
-            if not digests_df.empty:
-                self.db.execute("INSERT INTO block_ingestions SELECT block_number, coin FROM digests_df")
-            if not tx_df.empty:
+                self.db.execute("INSERT OR REPLACE INTO blocks SELECT number, timestamp FROM blocks_df")
+            if digests_in_batch:
+                self.coverage.add(digests_in_batch)
+            if not tx_df.empty and self.compact:
+                insert_transactions(self.db, tx_df)
+            elif not tx_df.empty:
                 self.db.execute("""                                                  
-                        INSERT INTO transactions (hash, log_number, block_number, coin, from_addr, to_addr, amount, usd_value , is_dex_swap)
-                        SELECT hash, log_number, block_number, coin, from_addr, to_addr, amount, usd_value, is_dex_swap FROM tx_df
+                        INSERT INTO transactions (hash, log_number, block_number, coin, from_addr, to_addr, amount, usd_value, token_amount, is_dex_swap)
+                        SELECT hash, log_number, block_number, coin, from_addr, to_addr, amount, usd_value, token_amount, is_dex_swap FROM tx_df
                     """)
+            if checkpoint is not None:
+                self.db.execute(*checkpoint)
             self.db.execute("COMMIT")
+            return True
         except Exception as e:
             self.db.execute("ROLLBACK")
-            print(f"ROLLBACK batch error: {e}")
\ No newline at end of file
+            print(f"ROLLBACK batch error: {e}")
+            return False
+
+    def rollback_from(self, block_number, checkpoint=None):
+        # removes everything ingested from block_number on, e.g. the blocks of a reorged out fork
+        table = "transactions_compact" if self.compact else "transactions"
+        self.db.execute("BEGIN TRANSACTION")
+        try:
+            self.db.execute(f"DELETE FROM {table} WHERE block_number >= ?", (block_number,))
+            self.db.execute("DELETE FROM block_ingestions WHERE block_number >= ?", (block_number,))
+            self.coverage.remove_from(block_number)
+            if checkpoint is not None:
+                self.db.execute(*checkpoint)
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        # DuckDB only sees the referencing rows as gone once their deletion is committed.
+        # Left over blocks rows are harmless, write_batch replaces them when the blocks are ingested again
+        self.db.execute("DELETE FROM blocks WHERE number >= ?", (block_number,))
\ No newline at end of file
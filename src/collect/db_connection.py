@@ -1,3 +1,4 @@
+import os
 import duckdb
 from pathlib import Path
 
@@ -5,12 +6,29 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 DB_PATH = PROJECT_ROOT / "data" / "main.duckdb"
 
-SCHEMA_SQL = """
+BASE_SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS blocks (
   "number"      BIGINT PRIMARY KEY,
   "timestamp"   TIMESTAMP
 );
 
+CREATE TABLE IF NOT EXISTS block_ingestions (
+  "block_number" BIGINT REFERENCES blocks(number),
+  "coin"         VARCHAR,
+  PRIMARY KEY (block_number, coin)
+);
+
+CREATE TABLE IF NOT EXISTS coin_values (
+  "coin"        VARCHAR,
+  "date"        DATE,
+  "usd_value"   DOUBLE,
+  PRIMARY KEY (coin, date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_coin_value ON coin_values(coin, date);
+"""
+
+TRANSACTIONS_SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS transactions (
   "hash"         VARCHAR,
   "log_number"   INTEGER,
@@ -23,30 +41,102 @@ CREATE TABLE IF NOT EXISTS transactions (
   "is_dex_swap"  BOOLEAN,
   PRIMARY KEY (hash, log_number)
 );
-                                                                                                                
-CREATE TABLE IF NOT EXISTS block_ingestions (
-  "block_number" BIGINT REFERENCES blocks(number),
-  "coin"         VARCHAR,
-  PRIMARY KEY (block_number, coin)
+
+-- decimal adjusted amount, usd_value = token_amount * coin_values.usd_value of the block's date
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS "token_amount" DOUBLE;
+
+CREATE INDEX IF NOT EXISTS idx_coin ON transactions(block_number, coin, is_dex_swap);
+"""
+
+SCHEMA_SQL = BASE_SCHEMA_SQL + TRANSACTIONS_SCHEMA_SQL
+
+# Compact layout: 32 byte hashes as BLOB, addresses interned to integer ids and coins as small ints.
+# "transactions" becomes a view decoding back to hex, see collect.compact_storage
+COMPACT_TABLES_SQL = """
+CREATE SEQUENCE IF NOT EXISTS address_ids START 1;
+
+CREATE TABLE IF NOT EXISTS addresses (
+  "id"           INTEGER PRIMARY KEY DEFAULT nextval('address_ids'),
+  "address"      BLOB UNIQUE
 );
 
-CREATE TABLE IF NOT EXISTS coin_values (
-  "coin"        VARCHAR,
-  "date"        DATE,
-  "usd_value"   DOUBLE,
-  PRIMARY KEY (coin, date)
+CREATE TABLE IF NOT EXISTS coins (
+  "id"           SMALLINT PRIMARY KEY,
+  "name"         VARCHAR UNIQUE
 );
 
-CREATE INDEX IF NOT EXISTS idx_coin ON transactions(block_number, coin, is_dex_swap);
-CREATE INDEX IF NOT EXISTS idx_coin_value ON coin_values(coin, date);
+CREATE TABLE IF NOT EXISTS transactions_compact (
+  "hash"         BLOB,
+  "log_number"   INTEGER,
+  "block_number" BIGINT REFERENCES blocks(number),
+  "coin_id"      SMALLINT,
+  "from_id"      INTEGER,
+  "to_id"        INTEGER,
+  "amount"       HUGEINT,
+  "usd_value"    DOUBLE,
+  "token_amount" DOUBLE,
+  "is_dex_swap"  BOOLEAN,
+  PRIMARY KEY (hash, log_number)
+);
+
+CREATE INDEX IF NOT EXISTS idx_coin_compact ON transactions_compact(block_number, coin_id, is_dex_swap);
 """
 
-def open_db() -> duckdb.DuckDBPyConnection:
-    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
-    con = duckdb.connect(str(DB_PATH))
-    con.execute(SCHEMA_SQL)
+TRANSACTIONS_VIEW_SQL = """
+CREATE OR REPLACE VIEW transactions AS
+SELECT
+  '0x' || lower(hex(t.hash))          AS hash,
+  t.log_number,
+  t.block_number,
+  c.name                              AS coin,
+  '0x' || lower(hex(fa.address))      AS from_addr,
+  '0x' || lower(hex(ta.address))      AS to_addr,
+  t.amount,
+  t.usd_value,
+  t.token_amount,
+  t.is_dex_swap
+FROM transactions_compact t
+JOIN coins c      ON c.id = t.coin_id
+JOIN addresses fa ON fa.id = t.from_id
+JOIN addresses ta ON ta.id = t.to_id;
+"""
+
+COMPACT_SCHEMA_SQL = COMPACT_TABLES_SQL + TRANSACTIONS_VIEW_SQL
+
+def is_compact(con) -> bool:
+    return con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'transactions_compact'"
+    ).fetchone()[0] > 0
+
+def open_db(path=None, read_only=False) -> duckdb.DuckDBPyConnection:
+    path = DB_PATH if path is None else path
+    if read_only:
+        # no schema statements, several processes can read the same file at once
+        return duckdb.connect(str(path), read_only=True)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect(str(path))
+    if is_compact(con):
+        con.execute(BASE_SCHEMA_SQL + COMPACT_SCHEMA_SQL)
+    else:
+        con.execute(SCHEMA_SQL)
     return con
 
+def export_snapshot(con, path):
+    # Copies the database to path for read only analysis processes, see DataCollector(read_only=True).
+    # A collector keeps the write lock on its own file, readers open the snapshot. It is written to a
+    # temporary file and renamed, so readers never see a partial copy and keep the one they have open
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    for leftover in (tmp, tmp.with_name(tmp.name + ".wal")):
+        leftover.unlink(missing_ok=True)
+    source = con.execute("SELECT current_database()").fetchone()[0]
+    con.execute(f"ATTACH '{tmp}' AS analysis_snapshot")
+    try:
+        con.execute(f"COPY FROM DATABASE {source} TO analysis_snapshot")
+    finally:
+        con.execute("DETACH analysis_snapshot")
+    os.replace(tmp, path)
+
 if __name__ == "__main__":
     con = open_db()
     print("DB ready.")
@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+
+class Endpoint:
+    def __init__(self, url, initial_limit, max_limit):
+        self.url = url
+        self.limit = float(min(initial_limit, max_limit))
+        self.max_limit = max_limit
+        self.in_flight = 0
+        # exponentially weighted moving averages
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_errors = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return self.ejected_until <= now and self.in_flight < int(self.limit)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejected": self.ejected_until > time.monotonic(),
+        }
+
+
+# Spreads requests over several RPC endpoints. Every endpoint has its own in-flight limit that is
+# adapted with AIMD: +1 after `limit` successful requests, halved on an error. Endpoints that keep
+# failing or are much slower than the rest are ejected for `cooldown` seconds.
+class EndpointPool:
+    def __init__(
+        self,
+        urls,
+        initial_limit=4,
+        max_limit=32,
+        cooldown=30,
+        max_consecutive_errors=3,
+        max_error_rate=0.5,
+        slow_factor=4.0,
+        ewma_alpha=0.2,
+    ):
+        self.endpoints = [Endpoint(url, initial_limit, max_limit) for url in urls]
+        self.cooldown = cooldown
+        self.max_consecutive_errors = max_consecutive_errors
+        self.max_error_rate = max_error_rate
+        self.slow_factor = slow_factor
+        self.ewma_alpha = ewma_alpha
+        self.condition = None
+
+    def _condition(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def _pick(self, now):
+        candidates = [e for e in self.endpoints if e.available(now)]
+        if not candidates:
+            return None
+        # least expected wait: queue length weighted by observed latency
+        return min(candidates, key=lambda e: (e.in_flight + 1) * (e.latency or 0.0))
+
+    def _next_readmission(self, now):
+        ejected = [e.ejected_until for e in self.endpoints if e.ejected_until > now]
+        return min(ejected) - now if ejected else None
+
+    async def acquire(self):
+        condition = self._condition()
+        async with condition:
+            while True:
+                now = time.monotonic()
+                endpoint = self._pick(now)
+                if endpoint is not None:
+                    endpoint.in_flight += 1
+                    endpoint.requests += 1
+                    return endpoint
+                # wake up on a release or when the next ejected endpoint is re-admitted
+                try:
+                    await asyncio.wait_for(condition.wait(), self._next_readmission(now))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, endpoint, ok, latency):
+        condition = self._condition()
+        async with condition:
+            endpoint.in_flight -= 1
+            a = self.ewma_alpha
+            endpoint.error_rate = (1 - a) * endpoint.error_rate + a * (0.0 if ok else 1.0)
+            if ok:
+                endpoint.consecutive_errors = 0
+                endpoint.latency = latency if endpoint.latency is None else (1 - a) * endpoint.latency + a * latency
+                endpoint.limit = min(endpoint.max_limit, endpoint.limit + 1 / endpoint.limit)
+            else:
+                endpoint.errors += 1
+                endpoint.consecutive_errors += 1
+                endpoint.limit = max(1.0, endpoint.limit / 2)
+
+            if self._should_eject(endpoint):
+                self._eject(endpoint)
+            condition.notify_all()
+
+    def _should_eject(self, endpoint):
+        if endpoint.consecutive_errors >= self.max_consecutive_errors:
+            return True
+        if endpoint.error_rate > self.max_error_rate:
+            return True
+        others = [
+            e.latency for e in self.endpoints
+            if e is not endpoint and e.latency is not None and e.ejected_until <= time.monotonic()
+        ]
+        if endpoint.latency is not None and others:
+            others.sort()
+            median = others[len(others) // 2]
+            return endpoint.latency > self.slow_factor * median
+        return False
+
+    def _eject(self, endpoint):
+        # never eject the last usable endpoint, requests would stall for the whole cooldown
+        now = time.monotonic()
+        if not any(e.ejected_until <= now for e in self.endpoints if e is not endpoint):
+            return
+        endpoint.ejected_until = now + self.cooldown
+        # re-admitted endpoints start over carefully
+        endpoint.limit = 1.0
+        endpoint.consecutive_errors = 0
+        endpoint.error_rate = 0.0
+        endpoint.latency = None
+
+    def stats(self):
+        return [e.stats() for e in self.endpoints]
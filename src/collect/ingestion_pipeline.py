@@ -0,0 +1,110 @@
+import asyncio
+
+# marks the end of a queue, every worker of the next stage gets one
+DONE = None
+
+
+class IngestionPipeline:
+    # fetch -> decode -> write with bounded queues in between, so that the node, the decoding and DuckDB
+    # work on different batches at the same time. There is only one writer, DuckDB allows a single writer.
+    def __init__(
+        self,
+        data_collector,
+        cancellation_token,
+        fetch_workers=4,
+        decode_workers=1,
+        queue_size=8,
+    ):
+        self.dc = data_collector
+        self.cancellation_token = cancellation_token
+        self.fetch_workers = fetch_workers
+        self.decode_workers = decode_workers
+        self.batch_queue = asyncio.Queue(maxsize=queue_size)
+        self.fetch_queue = asyncio.Queue(maxsize=queue_size)
+        self.decode_queue = asyncio.Queue(maxsize=queue_size)
+        self.depth_samples = {"batches": [], "fetched": [], "decoded": []}
+
+    def queue_depths(self):
+        # a full "fetched" queue means decoding is the bottleneck, a full "decoded" queue the writer
+        return {
+            "batches": self.batch_queue.qsize(),
+            "fetched": self.fetch_queue.qsize(),
+            "decoded": self.decode_queue.qsize(),
+        }
+
+    def average_queue_depths(self):
+        return {
+            name: sum(samples) / len(samples) if samples else 0.0
+            for name, samples in self.depth_samples.items()
+        }
+
+    async def run(self, batches, progress=None):
+        tasks = [asyncio.create_task(self._produce(batches))]
+        fetchers = [asyncio.create_task(self._fetch()) for _ in range(self.fetch_workers)]
+        decoders = [asyncio.create_task(self._decode()) for _ in range(self.decode_workers)]
+        writer = asyncio.create_task(self._write(progress))
+        tasks.extend(fetchers + decoders + [writer])
+
+        async def close_stage(workers, queue, n):
+            await asyncio.gather(*workers)
+            for _ in range(n):
+                await queue.put(DONE)
+
+        closers = [
+            asyncio.create_task(close_stage(fetchers, self.fetch_queue, self.decode_workers)),
+            asyncio.create_task(close_stage(decoders, self.decode_queue, 1)),
+        ]
+        # a failing stage would otherwise leave the others waiting on their queues forever
+        done, pending = await asyncio.wait(tasks + closers, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                for p in pending:
+                    p.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise task.exception()
+
+    async def _produce(self, batches):
+        for batch_start, batch_end in batches:
+            # in-flight batches are still written, only new ones are not started
+            if self.cancellation_token.is_canceled():
+                break
+            await self.batch_queue.put((batch_start, batch_end))
+        for _ in range(self.fetch_workers):
+            await self.batch_queue.put(DONE)
+
+    async def _fetch(self):
+        while True:
+            batch = await self.batch_queue.get()
+            if batch is DONE:
+                return
+            active_coins = [x["name"] for x in self.dc.active_coins]
+            missing = await self.dc.get_missing(list(range(*batch)), active_coins)
+            if len(missing) != 0:
+                await self.fetch_queue.put(await self.dc.fetch_missing(missing))
+            else:
+                await self.fetch_queue.put(())
+
+    async def _decode(self):
+        while True:
+            fetched = await self.fetch_queue.get()
+            if fetched is DONE:
+                return
+            if fetched:
+                await self.decode_queue.put(await self.dc.decode_blocks(*fetched))
+            else:
+                await self.decode_queue.put(())
+
+    async def _write(self, progress):
+        while True:
+            rows = await self.decode_queue.get()
+            if rows is DONE:
+                return
+            if rows:
+                await self.dc.store_batch(rows)
+
+            depths = self.queue_depths()
+            for name, depth in depths.items():
+                self.depth_samples[name].append(depth)
+            if progress is not None:
+                progress.set_postfix(depths)
+                progress.update(1)
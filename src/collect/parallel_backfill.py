@@ -0,0 +1,189 @@
+import asyncio
+import multiprocessing as mp
+import queue
+import signal
+import time
+from tqdm import tqdm
+from collect.data_manager import DataCollector
+
+BACKFILL_SQL = """
+CREATE TABLE IF NOT EXISTS backfill_shards (
+  "start_block"  BIGINT,
+  "end_block"    BIGINT,
+  "next_block"   BIGINT,
+  PRIMARY KEY (start_block, end_block)
+);
+"""
+
+# marks the end of the row queue for the writer
+DONE = None
+
+
+def split_range(start_block, end_block, n):
+    # at most n contiguous [start, end) shards covering [start_block, end_block), none for an empty range
+    # (e.g. a finished backfill that is started again)
+    if end_block <= start_block:
+        return []
+    size = max(-(-(end_block - start_block) // max(n, 1)), 1)
+    return [
+        (s, min(s + size, end_block))
+        for s in range(start_block, end_block, size)
+    ]
+
+
+def deferred_config(config):
+    # workers have no database, usd values are set by the writer with one UPDATE per batch
+    return {**config, "ingestion": {**config.get("ingestion", {}), "defer_usd": True, "decode_processes": 0}}
+
+
+def ignore_signals():
+    # only the coordinator reacts to SIGINT/SIGTERM and stops the others through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def discard_queued(rows_queue):
+    # a process only exits once its queued items are read, without a writer the coordinator reads them
+    while True:
+        try:
+            rows_queue.get_nowait()
+        except queue.Empty:
+            return
+
+
+def run_worker(config, shard, missing, rows_queue, stop_event):
+    ignore_signals()
+    asyncio.run(worker(config, shard, missing, rows_queue, stop_event))
+
+
+async def worker(config, shard, missing, rows_queue, stop_event):
+    # fetches and decodes the missing blocks of one shard, batch_size blocks at a time
+    dc = DataCollector(config=deferred_config(config), open_database=False)
+    await dc.open()
+    try:
+        batch_size = config["batch_size"]
+        for i in range(0, len(missing), batch_size):
+            if stop_event.is_set():
+                break
+            batch = missing[i:i + batch_size]
+            missing_dict, gathered_blocks = await dc.fetch_missing(batch)
+            rows = await dc.decode_blocks(missing_dict, gathered_blocks)
+            # the queue is bounded, a slow writer slows the workers down instead of filling the memory
+            await asyncio.to_thread(rows_queue.put, (shard, batch[-1][0] + 1, len(batch), rows))
+    finally:
+        await dc.close()
+
+
+def run_writer(config, rows_queue, written):
+    ignore_signals()
+    asyncio.run(writer(config, rows_queue, written))
+
+
+async def writer(config, rows_queue, written):
+    # the only process with a connection to the database
+    dc = DataCollector(config=deferred_config(config))
+    # a shard whose batch was rolled back keeps its checkpoint, the next run resumes before that batch
+    failed_shards = set()
+    try:
+        while True:
+            item = await asyncio.to_thread(rows_queue.get)
+            if item is DONE:
+                return
+            shard, next_block, n_blocks, rows = item
+            checkpoint = None
+            if shard not in failed_shards:
+                checkpoint = (
+                    "UPDATE backfill_shards SET next_block = ? WHERE start_block = ? AND end_block = ?",
+                    (next_block, shard[0], shard[1]),
+                )
+            if not await dc.store_batch(rows, checkpoint):
+                failed_shards.add(shard)
+            with written.get_lock():
+                written.value += n_blocks
+    finally:
+        await dc.close()
+
+
+async def prepare(config, n_shards):
+    # prefetches the prices and plans the shards, resuming at each shard's checkpoint
+    dc = DataCollector(config=config)
+    await dc.open()
+    try:
+        if config.get("prices", {}).get("prefetch", True):
+            await dc.prefetch_prices(config["start_block"], config["end_block"])
+        dc.db.execute(BACKFILL_SQL)
+        active_coins = [x["name"] for x in dc.active_coins]
+        plan = []
+        for shard in split_range(config["start_block"], config["end_block"], n_shards):
+            row = dc.db.execute(
+                "SELECT next_block FROM backfill_shards WHERE start_block = ? AND end_block = ?",
+                shard,
+            ).fetchone()
+            if row is None:
+                dc.db.execute("INSERT INTO backfill_shards VALUES (?, ?, ?)", (*shard, shard[0]))
+                next_block = shard[0]
+            else:
+                next_block = row[0]
+            missing = await dc.get_missing(list(range(next_block, shard[1])), active_coins)
+            plan.append((shard, missing))
+        return plan
+    finally:
+        await dc.close()
+
+
+def run_parallel_backfill(config):
+    # coordinator: N worker processes fetch and decode their own shard, one writer process owns DuckDB
+    backfill_config = config.get("backfill", {})
+    n_workers = backfill_config.get("workers", 4)
+    plan = asyncio.run(prepare(config, n_workers))
+
+    ctx = mp.get_context("spawn")
+    rows_queue = ctx.Queue(maxsize=backfill_config.get("queue_size", 16))
+    stop_event = ctx.Event()
+    written = ctx.Value("q", 0)
+
+    def handle_interrupt(signum, frame):
+        print("\nInterrupt received — finishing current batches and exiting…")
+        stop_event.set()
+
+    previous_handlers = {
+        s: signal.signal(s, handle_interrupt)
+        for s in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    writer_process = ctx.Process(target=run_writer, args=(config, rows_queue, written))
+    writer_process.start()
+    workers = [
+        ctx.Process(target=run_worker, args=(config, shard, missing, rows_queue, stop_event))
+        for shard, missing in plan
+        if missing
+    ]
+    for w in workers:
+        w.start()
+
+    progress = tqdm(total=sum(len(missing) for _, missing in plan), desc="Backfilling blocks", unit="block")
+    try:
+        while any(w.is_alive() for w in workers):
+            time.sleep(1)
+            progress.update(written.value - progress.n)
+            if not writer_process.is_alive():
+                if not stop_event.is_set():
+                    print("\nWriter process failed — stopping the workers…")
+                    stop_event.set()
+                discard_queued(rows_queue)
+        for w in workers:
+            w.join()
+    finally:
+        if writer_process.is_alive():
+            rows_queue.put(DONE)
+        writer_process.join()
+        progress.update(written.value - progress.n)
+        progress.close()
+        for s, handler in previous_handlers.items():
+            signal.signal(s, handler)
+
+    if writer_process.exitcode != 0:
+        print("The writer failed, rerun to resume at the last committed batch of each shard")
+    failed = [w for w in workers if w.exitcode != 0]
+    if failed:
+        print(f"{len(failed)} of {len(workers)} workers failed, rerun to resume their shards")
@@ -0,0 +1,350 @@
+from pathlib import Path
+import duckdb
+import yaml
+from collect.db_connection import open_db, is_compact
+from collect.coverage import BlockCoverage
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+ARCHIVE_PATH = PROJECT_ROOT / "data" / "archive"
+
+ARCHIVE_SQL = """
+CREATE TABLE IF NOT EXISTS archived_days (
+  "date"        DATE PRIMARY KEY
+);
+
+-- blocks and transaction rows of the day left in the database after its last export, a different count
+-- means rows were ingested into the day afterwards
+ALTER TABLE archived_days ADD COLUMN IF NOT EXISTS "hot_blocks" BIGINT;
+ALTER TABLE archived_days ADD COLUMN IF NOT EXISTS "hot_rows" BIGINT;
+
+CREATE TABLE IF NOT EXISTS archived_partitions (
+  "date"        DATE,
+  "coin"        VARCHAR,
+  PRIMARY KEY (date, coin)
+);
+"""
+
+HOT_COUNTS_SQL = """
+CREATE OR REPLACE TEMP TABLE hot_counts AS
+SELECT CAST(b.timestamp AS DATE) AS date, count(DISTINCT b.number) AS hot_blocks, count(t.hash) AS hot_rows
+FROM blocks b
+LEFT JOIN transactions t ON t.block_number = b.number
+GROUP BY 1
+"""
+
+
+def archived_relation(archive_path, kind):
+    # the archived blocks or transactions as a relation, an empty one while nothing is archived
+    files = Path(archive_path) / kind
+    if not any(files.rglob("*.parquet")):
+        if kind == "blocks":
+            return "(SELECT NULL::BIGINT AS number, NULL::TIMESTAMP AS timestamp, NULL::DATE AS date WHERE false)"
+        return "(SELECT NULL::VARCHAR AS hash, NULL::INTEGER AS log_number, NULL::DATE AS date WHERE false)"
+    return f"read_parquet('{files / '**' / '*.parquet'}', hive_partitioning = true)"
+
+
+def final_days(db, coins, archive_path=ARCHIVE_PATH, before=None):
+    # A day is final once all of its blocks are known and ingested for every coin: its block numbers have
+    # no gap, the blocks right before and after it are known (in the database or the archive), and
+    # block_coverage spans them for each coin
+    if not coins:
+        return []
+    known = f"""
+        SELECT number FROM blocks
+        UNION ALL
+        SELECT number FROM {archived_relation(archive_path, "blocks")}
+    """
+    return [
+        row[0]
+        for row in db.execute(
+            f"""
+            SELECT d.date
+            FROM (
+                SELECT CAST(timestamp AS DATE) AS date, min(number) AS lo, max(number) AS hi, count(*) AS n
+                FROM blocks
+                GROUP BY 1
+            ) d
+            WHERE d.n = d.hi - d.lo + 1
+              AND d.lo - 1 IN ({known})
+              AND d.hi + 1 IN ({known})
+              AND (CAST(? AS DATE) IS NULL OR d.date < CAST(? AS DATE))
+              AND (
+                  SELECT count(DISTINCT c.coin)
+                  FROM block_coverage c
+                  WHERE c.coin IN (SELECT unnest(?))
+                    AND c.start_block <= d.lo
+                    AND c.end_block >= d.hi
+              ) = ?
+            ORDER BY d.date
+            """,
+            (None if before is None else str(before), None if before is None else str(before), list(coins), len(set(coins))),
+        ).fetchall()
+    ]
+
+
+def export_finalized_days(db, coins, archive_path=ARCHIVE_PATH, before=None, compact_hot=False):
+    # Writes every final, not yet archived day (before `before` if given) of the given coins to hive partitioned Parquet:
+    #   blocks/date=.../*.parquet and transactions/date=.../coin=.../*.parquet
+    # Rows ingested into an archived day later (new coins, late blocks) are appended on the next export.
+    # With compact_hot the rows that are in the archive are deleted from the database afterwards, they are
+    # read through ParquetBlockReader or DataCollector.get_blocks with archive.compact_hot from then on.
+    db.execute(ARCHIVE_SQL)
+    # creates block_coverage if the database has none yet
+    BlockCoverage(db)
+    archive_path = Path(archive_path)
+    archive_path.mkdir(parents=True, exist_ok=True)
+    archived_blocks = archived_relation(archive_path, "blocks")
+    archived_transactions = archived_relation(archive_path, "transactions")
+
+    archived = {row[0] for row in db.execute("SELECT date FROM archived_days").fetchall()}
+    days = [day for day in final_days(db, coins, archive_path, before) if day not in archived]
+    db.execute("CREATE OR REPLACE TEMP TABLE export_days AS SELECT unnest(?::DATE[]) AS date", ([str(day) for day in days],))
+    db.execute(HOT_COUNTS_SQL)
+    # archived days with rows ingested after their last export, only the rows missing in the archive are exported
+    db.execute(
+        """
+        CREATE OR REPLACE TEMP TABLE dirty_days AS
+        SELECT a.date
+        FROM archived_days a
+        JOIN hot_counts h ON h.date = a.date
+        WHERE a.hot_blocks IS DISTINCT FROM h.hot_blocks OR a.hot_rows IS DISTINCT FROM h.hot_rows
+        """
+    )
+
+    db.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE export_blocks AS
+        SELECT b.number, b.timestamp, CAST(b.timestamp AS DATE) AS date
+        FROM blocks b
+        WHERE CAST(b.timestamp AS DATE) IN (SELECT date FROM export_days)
+           OR (
+               CAST(b.timestamp AS DATE) IN (SELECT date FROM dirty_days)
+               AND NOT EXISTS (SELECT 1 FROM {archived_blocks} a WHERE a.number = b.number)
+           )
+        """
+    )
+    db.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE export_rows AS
+        -- amounts are capped at BIGINT on ingestion, Parquet would store HUGEINT as DOUBLE
+        SELECT t.hash, t.log_number, t.block_number, t.from_addr, t.to_addr, CAST(t.amount AS BIGINT) AS amount, t.usd_value,
+               t.token_amount, t.is_dex_swap, CAST(b.timestamp AS DATE) AS date, t.coin
+        FROM transactions t
+        JOIN blocks b ON b.number = t.block_number
+        WHERE CAST(b.timestamp AS DATE) IN (SELECT date FROM export_days)
+           OR (
+               CAST(b.timestamp AS DATE) IN (SELECT date FROM dirty_days)
+               AND NOT EXISTS (
+                   SELECT 1 FROM {archived_transactions} a
+                   WHERE CAST(a.date AS DATE) = CAST(b.timestamp AS DATE)
+                     AND a.hash = t.hash
+                     AND a.log_number = t.log_number
+               )
+           )
+        """
+    )
+
+    if db.execute("SELECT count(*) FROM export_blocks").fetchone()[0] > 0:
+        db.execute(
+            f"""
+            COPY (SELECT * FROM export_blocks ORDER BY number)
+            TO '{archive_path / "blocks"}' (FORMAT PARQUET, PARTITION_BY (date), APPEND)
+            """
+        )
+    if db.execute("SELECT count(*) FROM export_rows").fetchone()[0] > 0:
+        db.execute(
+            f"""
+            COPY (SELECT * FROM export_rows ORDER BY block_number)
+            TO '{archive_path / "transactions"}' (FORMAT PARQUET, PARTITION_BY (date, coin), APPEND)
+            """
+        )
+
+    db.execute("BEGIN TRANSACTION")
+    try:
+        db.execute("INSERT INTO archived_days (date) SELECT date FROM export_days")
+        db.execute("INSERT OR IGNORE INTO archived_partitions SELECT DISTINCT date, coin FROM export_rows")
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    if compact_hot:
+        delete_archived_rows(db, archive_path)
+    # counted after the compaction, until then an interrupted run finds the days dirty and exports nothing twice
+    db.execute(HOT_COUNTS_SQL)
+    db.execute(
+        """
+        UPDATE archived_days a
+        SET hot_blocks = coalesce(h.hot_blocks, 0), hot_rows = coalesce(h.hot_rows, 0)
+        FROM (SELECT date FROM export_days UNION SELECT date FROM dirty_days) d
+        LEFT JOIN hot_counts h ON h.date = d.date
+        WHERE a.date = d.date
+        """
+    )
+    return days
+
+
+def delete_archived_rows(db, archive_path=ARCHIVE_PATH):
+    # Deletes the rows of archived days that are in the Parquet archive, rows that are not (yet) stay.
+    # block_coverage is kept, so archived blocks are not ingested again
+    archived_blocks = archived_relation(archive_path, "blocks")
+    archived_transactions = archived_relation(archive_path, "transactions")
+    day_blocks = """
+        SELECT number FROM blocks
+        WHERE CAST(timestamp AS DATE) IN (SELECT date FROM archived_days)
+    """
+    if is_compact(db):
+        db.execute(
+            f"""
+            DELETE FROM transactions_compact t
+            WHERE t.block_number IN ({day_blocks})
+              AND EXISTS (
+                  SELECT 1 FROM {archived_transactions} a
+                  WHERE a.hash = '0x' || lower(hex(t.hash)) AND a.log_number = t.log_number
+              )
+            """
+        )
+        table = "transactions_compact"
+    else:
+        db.execute(
+            f"""
+            DELETE FROM transactions t
+            WHERE t.block_number IN ({day_blocks})
+              AND EXISTS (
+                  SELECT 1 FROM {archived_transactions} a
+                  WHERE a.hash = t.hash AND a.log_number = t.log_number
+              )
+            """
+        )
+        table = "transactions"
+    # blocks that are archived and have no rows left
+    removable = f"""
+        SELECT number FROM ({day_blocks})
+        WHERE number IN (SELECT number FROM {archived_blocks})
+          AND number NOT IN (SELECT block_number FROM {table})
+    """
+    db.execute(f"DELETE FROM block_ingestions WHERE block_number IN ({removable})")
+    # DuckDB only sees the referencing rows as gone once their deletion is committed
+    db.execute(f"DELETE FROM blocks WHERE number IN ({removable})")
+
+
+def archived_sources(db, archive_path, start_block, end_block):
+    # (blocks, transactions) relations for DataCollector.get_blocks / get_defi_values over [start_block, end_block) that add the
+    # rows deleted by compact_hot from the archive, None if the range has no archived blocks
+    archived_blocks = archived_relation(archive_path, "blocks")
+    start_date, end_date = db.execute(
+        f"SELECT min(date), max(date) FROM {archived_blocks} WHERE number BETWEEN ? AND ?",
+        (start_block, end_block - 1),
+    ).fetchone()
+    if start_date is None:
+        return None
+    # literal bounds prune the date partitions
+    span = f"CAST(date AS DATE) BETWEEN DATE '{start_date}' AND DATE '{end_date}'"
+    blocks = f"""(
+        SELECT number, timestamp FROM blocks
+        UNION ALL
+        SELECT number, timestamp FROM {archived_blocks} a
+        WHERE {span} AND NOT EXISTS (SELECT 1 FROM blocks b WHERE b.number = a.number)
+    )"""
+    transactions = f"""(
+        SELECT hash, block_number, coin, from_addr, to_addr, amount, usd_value, is_dex_swap FROM transactions
+        UNION ALL
+        SELECT a.hash, a.block_number, a.coin, a.from_addr, a.to_addr, CAST(a.amount AS HUGEINT), a.usd_value, a.is_dex_swap
+        FROM {archived_relation(archive_path, "transactions")} a
+        WHERE {span}
+          AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.hash = a.hash AND t.log_number = a.log_number)
+    )"""
+    return blocks, transactions
+
+
+class ParquetBlockReader:
+    # get_blocks compatible reads from the Parquet archive. Filters on date and coin prune whole
+    # partitions, only the selected columns are read from the files.
+    def __init__(self, archive_path=ARCHIVE_PATH):
+        archive_path = Path(archive_path)
+        self.db = duckdb.connect()
+        self.blocks = f"read_parquet('{archive_path / 'blocks' / '**' / '*.parquet'}', hive_partitioning = true)"
+        self.transactions = f"read_parquet('{archive_path / 'transactions' / '**' / '*.parquet'}', hive_partitioning = true)"
+
+    def close(self):
+        self.db.close()
+
+    def get_date_span(self, start_block, end_block):
+        return self.db.execute(
+            f"""
+            SELECT min(date), max(date)
+            FROM {self.blocks}
+            WHERE number BETWEEN ? AND ?
+            """,
+            (start_block, end_block - 1),
+        ).fetchone()
+
+    def scan(self, columns, start_date, end_date, coins=None):
+        # a relation over the archived transactions of [start_date, end_date], e.g. for analyses across months
+        coin_filter = ""
+        params = [str(start_date), str(end_date)]
+        if coins:
+            coin_filter = "AND coin IN (SELECT unnest(?))"
+            params.append(list(coins))
+        return self.db.execute(
+            f"""
+            SELECT {", ".join(columns)}
+            FROM {self.transactions}
+            WHERE date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+            {coin_filter}
+            """,
+            params,
+        )
+
+    def get_blocks(self, start_block, end_block, with_dex = False):
+        # same rows as DataCollector.get_blocks: (number, timestamp, [transaction structs])
+        start_date, end_date = self.get_date_span(start_block, end_block)
+        if start_date is None:
+            return []
+        return self.db.execute(
+            f"""
+            SELECT
+              b.number,
+              b.timestamp,
+              coalesce(
+                list(
+                  struct_pack(
+                    hash        := t.hash,
+                    coin        := t.coin,
+                    "from"      := t.from_addr,
+                    "to"        := t.to_addr,
+                    amount      := CAST(t.amount AS HUGEINT),
+                    usd_value   := t.usd_value,
+                    is_dex_swap := t.is_dex_swap
+                  )
+                ) FILTER (WHERE t.hash IS NOT NULL),
+                []
+              ) AS transactions
+            FROM {self.blocks} b
+            LEFT JOIN (
+                SELECT *
+                FROM {self.transactions}
+                WHERE date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+                {"" if with_dex else "AND coalesce(is_dex_swap, false) = false"}
+            ) t
+              ON t.block_number = b.number
+            WHERE b.date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+              AND b.number BETWEEN ? AND ?
+            GROUP BY b.number, b.timestamp
+            ORDER BY b.timestamp;
+            """,
+            (str(start_date), str(end_date), str(start_date), str(end_date), start_block, end_block - 1),
+        ).fetchall()
+
+
+if __name__ == "__main__":
+    with (PROJECT_ROOT / "config" / "config.yaml").open("r") as f:
+        config = yaml.safe_load(f)
+    archive_config = config.get("archive", {})
+    con = open_db()
+    days = export_finalized_days(
+        con,
+        [coin["name"] for coin in config["token"] if coin["active"]],
+        PROJECT_ROOT / archive_config.get("path", "data/archive"),
+        compact_hot=archive_config.get("compact_hot", False),
+    )
+    print(f"Archived {len(days)} days.")
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+import aiohttp
+
+COINGECKO_DEMO_URL = "https://api.coingecko.com/api/v3"
+ASSET_PLATFORM = 'ethereum'
+ETH_NAME = "ETH"
+
+
+class RateLimiter:
+    # spaces request starts evenly so that at most calls_per_minute requests start per minute
+    def __init__(self, calls_per_minute):
+        self.interval = 60 / calls_per_minute
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_slot > now:
+                await asyncio.sleep(self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+
+def retry_after(error):
+    # seconds of the Retry-After header of a 429, which CoinGecko sends as a number of seconds, None without one
+    try:
+        return max(float((error.headers or {}).get("Retry-After")), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class PricePrefetcher:
+    # Fills the (coin, date) gaps of coin_values for a date span with concurrent CoinGecko range requests,
+    # so that ingestion never has to stop for a price lookup.
+    def __init__(
+        self,
+        db,
+        api_key,
+        base_url=COINGECKO_DEMO_URL,
+        calls_per_minute=30,
+        max_concurrency=4,
+        chunk_days=91,
+        max_retries=5,
+    ):
+        self.db = db
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = RateLimiter(calls_per_minute)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # CoinGecko answers ranges above 90 days with daily prices, shorter ones hourly
+        self.chunk_days = chunk_days
+        self.max_retries = max_retries
+
+    def get_gaps(self, coins, start_date, end_date):
+        rows = self.db.execute(
+            """
+            SELECT c.coin, CAST(d.date AS DATE) AS date
+            FROM unnest(?) AS c(coin)
+            CROSS JOIN range(CAST(? AS DATE), CAST(? AS DATE) + INTERVAL 1 DAY, INTERVAL 1 DAY) AS d(date)
+            LEFT JOIN coin_values cv
+              ON cv.coin = c.coin
+             AND cv.date = CAST(d.date AS DATE)
+            WHERE cv.coin IS NULL
+            ORDER BY c.coin, date
+            """,
+            ([coin["name"] for coin in coins], start_date.isoformat(), end_date.isoformat()),
+        ).fetchall()
+        gaps = {}
+        for coin_name, date in rows:
+            gaps.setdefault(coin_name, []).append(date)
+        return gaps
+
+    def get_requests(self, coins, start_date, end_date):
+        # one request per coin and chunk_days window, starting at the first missing date of a window
+        coins_by_name = {coin["name"]: coin for coin in coins}
+        requests = []
+        for coin_name, dates in self.get_gaps(coins, start_date, end_date).items():
+            window_end = None
+            for date in dates:
+                if window_end is None or date >= window_end:
+                    window_end = date + timedelta(days=self.chunk_days)
+                    requests.append((coins_by_name[coin_name], date, window_end))
+        return requests
+
+    async def prefetch(self, coins, start_date, end_date):
+        requests = self.get_requests(coins, start_date, end_date)
+        if not requests:
+            return 0
+        headers = {"x-cg-demo-api-key": self.api_key} if self.api_key else {}
+        async with aiohttp.ClientSession(headers=headers) as session:
+            results = await asyncio.gather(*[
+                self.fetch_range(session, coin, from_date, to_date)
+                for coin, from_date, to_date in requests
+            ])
+        rows = [row for result in results for row in result]
+        if rows:
+            self.db.executemany(
+                """
+                INSERT INTO coin_values (coin, date, usd_value)
+                VALUES (?, ?, ?)
+                ON CONFLICT (coin, date) DO UPDATE SET usd_value = excluded.usd_value
+                """,
+                rows,
+            )
+        return len(rows)
+
+    async def fetch_range(self, session, coin, from_date, to_date):
+        if coin["name"] == ETH_NAME:
+            url = f"{self.base_url}/coins/{ASSET_PLATFORM}/market_chart/range"
+        else:
+            url = f"{self.base_url}/coins/{ASSET_PLATFORM}/contract/{coin['address']}/market_chart/range"
+        params = {
+            "vs_currency": "usd",
+            "from": int(datetime.combine(from_date, datetime.min.time()).timestamp()),
+            "to": int(datetime.combine(to_date, datetime.min.time()).timestamp()),
+        }
+
+        attempt = 0
+        while True:
+            await self.rate_limiter.wait()
+            try:
+                async with self.semaphore:
+                    async with session.get(url, params=params) as resp:
+                        resp.raise_for_status()
+                        data = await resp.json(content_type=None)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # only the quota (429), server errors and timeouts pass, any other 4xx fails the same way again
+                status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+                transient = isinstance(e, asyncio.TimeoutError) or status == 429 or (status is not None and status >= 500)
+                attempt += 1
+                if not transient or attempt > self.max_retries:
+                    print(f"price prefetch for {coin['name']} from {from_date} failed: {e}")
+                    return []
+                delay = retry_after(e) if status == 429 else None
+                await asyncio.sleep(2 ** attempt if delay is None else delay)
+
+        # the last price of a day, like DataCollector.get_price whose upsert keeps the last sample
+        rows = {}
+        for price in data.get("prices", []):
+            date = datetime.fromtimestamp(price[0] / 1000).date().isoformat()
+            rows[date] = (coin["name"], date, price[1])
+        return list(rows.values())
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class RawBlockCache:
+    # Content addressed cache of the raw JSON blocks (with receipts) returned by the node.
+    # Every put() writes one zstd compressed segment named after the sha256 of its content,
+    # index.jsonl maps the block numbers of each segment to that digest.
+    def __init__(self, path, level=3, cached_segments=4):
+        # optional dependency, only needed when the cache is enabled
+        import zstandard
+
+        self.path = Path(path)
+        self.objects = self.path / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path / "index.jsonl"
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.cached_segments = cached_segments
+        self.segments = OrderedDict()
+        self.index = {}
+        # get/put run in asyncio.to_thread from several fetchers at once: the LRU, the index, index.jsonl
+        # and the zstd (de)compressors, which are not thread safe, are only used under this lock
+        self.lock = threading.Lock()
+        if self.index_path.exists():
+            with self.index_path.open("r") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    for number in entry["blocks"]:
+                        self.index[number] = entry["segment"]
+
+    def __contains__(self, block_number):
+        return block_number in self.index
+
+    def _segment_path(self, digest):
+        return self.objects / digest[:2] / f"{digest}.json.zst"
+
+    def _load_segment(self, digest):
+        # called with self.lock held
+        if digest in self.segments:
+            self.segments.move_to_end(digest)
+            return self.segments[digest]
+        with self._segment_path(digest).open("rb") as f:
+            blocks = json.loads(self.decompressor.decompress(f.read()))
+        segment = {int(block["number"], 16): block for block in blocks}
+        self.segments[digest] = segment
+        if len(self.segments) > self.cached_segments:
+            self.segments.popitem(last=False)
+        return segment
+
+    def get(self, block_numbers):
+        # returns {block number: block} for all requested blocks that are cached
+        hits = {}
+        with self.lock:
+            for number in block_numbers:
+                digest = self.index.get(number)
+                if digest is not None:
+                    hits[number] = self._load_segment(digest)[number]
+        return hits
+
+    def put(self, blocks):
+        if not blocks:
+            return
+        with self.lock:
+            data = self.compressor.compress(json.dumps(blocks, separators=(",", ":")).encode())
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._segment_path(digest)
+            if not path.exists():
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                with tmp.open("wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+
+            numbers = [int(block["number"], 16) for block in blocks]
+            # the index line is written last, a crash before leaves an unreferenced segment only
+            with self.index_path.open("a") as f:
+                f.write(json.dumps({"segment": digest, "blocks": numbers}) + "\n")
+            for number in numbers:
+                self.index[number] = digest
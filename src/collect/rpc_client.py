@@ -1,15 +1,46 @@
 import asyncio
+import time
 import aiohttp
 import numpy
+from collect.endpoint_pool import EndpointPool
+
+
+class RPCError(Exception):
+    pass
+
 
 class RPCClient():
-    def __init__(self, rpc_url):
+    def __init__(
+        self,
+        rpc_url,
+        batch_size=50,
+        max_in_flight=8,
+        max_retries=5,
+        backoff=0.5,
+        timeout=60,
+        pool_config=None,
+        cache=None,
+    ):
         self.session = None
-        self.rpc_url = rpc_url
+        # optional RawBlockCache, read before going to the network
+        self.cache = cache
+        # a single url or a list of equivalent nodes
+        self.rpc_urls = [rpc_url] if isinstance(rpc_url, str) else list(rpc_url)
+        self.rpc_url = self.rpc_urls[0]
+        # number of blocks packed into one JSON-RPC array request
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool = EndpointPool(
+            self.rpc_urls,
+            max_limit=max_in_flight,
+            **(pool_config or {}),
+        )
 
     async def open(self):
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
 
     async def close(self):
         if self.session and not self.session.closed:
@@ -17,33 +48,142 @@ class RPCClient():
             await self.session.close()
 
     async def __aenter__(self):
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession(timeout=self._timeout, headers=self._headers)
+        await self.open()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        if self._session and not self._session.closed:
-            await self._session.close()
-        
+        if self.session and not self.session.closed:
+            await self.session.close()
+
     async def rpc_call(self, method, params=[]):
-        async with self.session.post(self.rpc_url, json={
-            "jsonrpc":"2.0",
-            "id": 1,
-            "method": method,
-            "params": params
-        }) as resp:
-            result = await resp.json()
-            return result["result"]
+        result = await self.rpc_batch([(method, params)])
+        return result[0]
+
+    async def rpc_batch(self, calls):
+        # sends all (method, params) pairs as one JSON-RPC array request, results are matched back by id.
+        # calls that failed or are missing from the response are resent with exponential backoff.
+        # An explicit "result": null (e.g. a block past the head) is an answer and returned as None
+        results = [None] * len(calls)
+        answered = set()
+        pending = list(range(len(calls)))
+        attempt = 0
+        while True:
+            payload = [
+                {
+                    "jsonrpc": "2.0",
+                    "id": i,
+                    "method": calls[i][0],
+                    "params": calls[i][1],
+                }
+                for i in pending
+            ]
+            response = []
+            error = None
+            endpoint = await self.pool.acquire()
+            start = time.monotonic()
+            try:
+                async with self.session.post(endpoint.url, json=payload) as resp:
+                    resp.raise_for_status()
+                    response = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = e
+
+            # a node rejecting the whole batch answers with a single error object
+            if not isinstance(response, list):
+                error = response.get("error") if isinstance(response, dict) else response
+                response = []
+
+            answered_before = len(answered)
+            for r in response:
+                i = r.get("id")
+                if i in pending and "result" in r and r.get("error") is None:
+                    results[i] = r["result"]
+                    answered.add(i)
+                elif r.get("error") is not None:
+                    error = r["error"]
+
+            await self.pool.release(
+                endpoint,
+                ok=error is None or len(answered) > answered_before,
+                latency=time.monotonic() - start,
+            )
+
+            pending = [i for i in pending if i not in answered]
+            if not pending:
+                return results
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise RPCError(f"{len(pending)} of {len(calls)} calls failed after {self.max_retries} retries: {error}")
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
 
     async def process_block(self, block_number):
-        block_task = self.rpc_call( "eth_getBlockByNumber", [hex(block_number), True])
-        receipt_task = self.rpc_call( "eth_getBlockReceipts", [hex(block_number)])
-        result = await asyncio.gather(block_task, receipt_task)
-        block = result[0]
-        block["receipts"] = result[1]
-        return block
-    
-    async def get_batch(self, start_block, end_block):
-        tasks = [self.process_block( b) for b in range(start_block, end_block)]
-        return asyncio.gather(*tasks)
+        blocks = await self.process_blocks([block_number])
+        return blocks[0]
+
+    async def process_blocks(self, block_numbers, use_cache=True):
+        # batch_size blocks (block + receipts) per request, spread over all endpoints within their in-flight limits.
+        # The raw cache is keyed by block number, blocks near the head that can still be reorged bypass it
+        cached = {}
+        use_cache = use_cache and self.cache is not None
+        if use_cache:
+            cached = await asyncio.to_thread(self.cache.get, block_numbers)
+        to_fetch = [b for b in block_numbers if b not in cached]
+        chunks = [
+            to_fetch[i:i + self.batch_size]
+            for i in range(0, len(to_fetch), self.batch_size)
+        ]
+        results = await asyncio.gather(*[self._process_chunk(chunk) for chunk in chunks])
+        fetched = [block for chunk in results for block in chunk]
+        if use_cache:
+            await asyncio.to_thread(self.cache.put, fetched)
+
+        blocks = {**cached, **{int(block["number"], 16): block for block in fetched}}
+        return [blocks[b] for b in block_numbers]
 
+    async def _process_chunk(self, block_numbers):
+        calls = []
+        for block_number in block_numbers:
+            calls.append(("eth_getBlockByNumber", [hex(block_number), True]))
+            calls.append(("eth_getBlockReceipts", [hex(block_number)]))
+        result = await self.rpc_batch(calls)
+        blocks = []
+        for i, block_number in enumerate(block_numbers):
+            block = result[2 * i]
+            if block is None:
+                raise RPCError(f"block {block_number} is not available on the node")
+            block["receipts"] = result[2 * i + 1]
+            blocks.append(block)
+        return blocks
+
+    async def get_blocks(self, block_numbers, full_transactions):
+        # full_transactions holds one flag per block, without it only the transaction hashes are returned
+        calls = [
+            ("eth_getBlockByNumber", [hex(block_number), full])
+            for block_number, full in zip(block_numbers, full_transactions)
+        ]
+        blocks = await self._batched(calls)
+        for block_number, block in zip(block_numbers, blocks):
+            if block is None:
+                raise RPCError(f"block {block_number} is not available on the node")
+        return blocks
+
+    async def get_logs(self, block_ranges, log_filter):
+        # one eth_getLogs call per inclusive (from_block, to_block) range, all logs are returned in one list
+        calls = [
+            ("eth_getLogs", [{**log_filter, "fromBlock": hex(from_block), "toBlock": hex(to_block)}])
+            for from_block, to_block in block_ranges
+        ]
+        results = await self._batched(calls)
+        return [log for logs in results for log in logs]
+
+    async def _batched(self, calls):
+        chunks = [
+            calls[i:i + self.batch_size]
+            for i in range(0, len(calls), self.batch_size)
+        ]
+        results = await asyncio.gather(*[self.rpc_batch(chunk) for chunk in chunks])
+        return [r for chunk in results for r in chunk]
+
+    async def get_batch(self, start_block, end_block):
+        return await self.process_blocks(list(range(start_block, end_block)))
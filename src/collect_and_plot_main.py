@@ -1,4 +1,5 @@
 import asyncio
+import functools
 from pathlib import Path
 import gc
 import numpy
@@ -11,13 +12,18 @@ from xxlimited_35 import Null
 
 from collect.data_manager import DataCollector
 from collect.cancellation_token import CancellationToken
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from processing.alg_cumulative_wealth_gain import CumulativeWealthGain
+from processing.alg_cumulative_wealth_gain_array import CumulativeWealthGainArray
 from processing.alg_transaction_counting import TransactionCounting
 from processing.alg_defi_transactions import DefiTransactions
+from processing.multi_window import MultiWindow, WindowSeries
+from processing.checkpoint import CheckpointStore
+from processing.parallel_runner import run_parallel
+from processing.block_columns import run_streaming
 from analysis.speed_comparision import SpeedComparison
 from analysis.value_comparision import ValueComparison
+from analysis.rolling import rolling_percentage, downsample
+from analysis.plot_rendering import render_all
 import signal
 import datetime
 
@@ -29,6 +35,17 @@ seconds_to_string = {
     604800 : "one week"
 }
 
+def average_times(timed):
+    # "name build-up/sliding: mean ms" of the SpeedComparison ns timings that have samples, a run resumed
+    # from a checkpoint covering the whole range times no block at all
+    lines = [
+        f"{name} {phase}: {numpy.mean(times) / 1e6} ms"
+        for phase, attribute in (("build-up", "time_build_up_window"), ("sliding ", "time_sliding_window"))
+        for name, speed in timed.items()
+        if len(times := getattr(speed, attribute)) > 0
+    ]
+    return "\n".join(lines) if lines else "no blocks processed in this run"
+
 def get_config() -> dict:
     load_dotenv(PROJECT_ROOT / ".env")
     path = PROJECT_ROOT / "config" / "config.yaml"
@@ -41,7 +58,9 @@ def get_config() -> dict:
 async def main():
     cancellation_token = CancellationToken()
     config = get_config()
-    dc = DataCollector(config=config)
+    # plots from the analysis_db snapshot, without ingestion, RPC or CoinGecko
+    read_only = config.get("analysis_db", {}).get("read_only", False)
+    dc = DataCollector(config=config, read_only=read_only)
 
     loop = asyncio.get_running_loop()
 
@@ -55,26 +74,91 @@ async def main():
     await dc.open()
 
     try:
+        if not read_only and config.get("prices", {}).get("prefetch", True):
+            print(f"Prefetched {await dc.prefetch_prices(config['start_block'], config['end_block'])} daily prices")
 
         # analysis
-        cumulative_wealth_gain = [
-            ValueComparison(SpeedComparison(CumulativeWealthGain(n),n),n)
-            for n in config["analysis"]["cumulative_wealth_gain"]
-        ]
-        transaction_counting = [
-            ValueComparison(SpeedComparison(TransactionCounting(n),n),n)
-            for n in config["analysis"]["transaction_counting"]
-        ]
-        defi_transactions = [
-            ValueComparison(SpeedComparison(DefiTransactions(n), n), n)
-            for n in config["analysis"]["defi_transactions"]
-        ]
+        # one pass over a shared block buffer for all deltas instead of one instance per algorithm and delta
+        multi_window = config.get("processing", {}).get("multi_window", False)
+        # the total volume series of all deltas from one DuckDB window query after ingestion
+        tc_pushdown = config.get("processing", {}).get("tc_pushdown", False)
+        # >0 evaluates every algorithm and delta in its own process after ingestion, over shared memory columns
+        parallel_processes = config.get("processing", {}).get("parallel_processes", 0)
+        # streams the blocks as NumPy column chunks after ingestion instead of transaction dicts per batch
+        columnar = config.get("processing", {}).get("columnar", False) or parallel_processes > 0
+        if config.get("archive", {}).get("compact_hot", False) and (tc_pushdown or columnar):
+            # only get_blocks and get_defi_values read the days compacted into the Parquet archive
+            print("processing.tc_pushdown, columnar and parallel_processes read the database only, disabled with archive.compact_hot")
+            tc_pushdown = columnar = False
+            parallel_processes = 0
+        if columnar:
+            multi_window = False
+            # filled by run_parallel / run_streaming after the loop
+            cumulative_wealth_gain = defi_transactions = None
+            transaction_counting = [WindowSeries(n) for n in config["analysis"]["transaction_counting"]] if tc_pushdown else None
+        elif multi_window:
+            windows = SpeedComparison(
+                MultiWindow(
+                    config["analysis"]["cumulative_wealth_gain"],
+                    config["analysis"]["transaction_counting"],
+                    config["analysis"]["defi_transactions"],
+                ),
+                max(config["analysis"]["cumulative_wealth_gain"]),
+            )
+            cumulative_wealth_gain = windows.algorithm.series["cumulative_wealth_gain"]
+            transaction_counting = windows.algorithm.series["transaction_counting"]
+            defi_transactions = windows.algorithm.series["defi_transactions"]
+        else:
+            processing = config.get("processing", {})
+            if processing.get("cwg_engine", "dict") == "array":
+                cwg_engine = CumulativeWealthGainArray
+            else:
+                cwg_engine = functools.partial(
+                    CumulativeWealthGain,
+                    epsilon=processing.get("cwg_epsilon", 1e-6),
+                    max_bytes=processing.get("cwg_max_bytes"),
+                )
+            cumulative_wealth_gain = [
+                ValueComparison(SpeedComparison(cwg_engine(n),n),n)
+                for n in config["analysis"]["cumulative_wealth_gain"]
+            ]
+            if tc_pushdown:
+                transaction_counting = [WindowSeries(n) for n in config["analysis"]["transaction_counting"]]
+            else:
+                transaction_counting = [
+                    ValueComparison(SpeedComparison(TransactionCounting(n),n),n)
+                    for n in config["analysis"]["transaction_counting"]
+                ]
+            defi_transactions = [
+                ValueComparison(SpeedComparison(DefiTransactions(n), n), n)
+                for n in config["analysis"]["defi_transactions"]
+            ]
 
+        # DeFi values of each batch aggregated in DuckDB instead of per block in Python
+        defi_sql = config.get("processing", {}).get("defi_sql", False)
         timestamps = []
 
+        # resume the windows and values of an earlier run with the same start block
+        checkpoints = config.get("checkpoints", {})
+        resume_block = config["start_block"]
+        store = None
+        if checkpoints.get("enabled", False):
+            if multi_window or columnar:
+                print("Checkpoints are not supported with processing.multi_window, columnar or parallel_processes, replaying all blocks")
+            else:
+                store = CheckpointStore(PROJECT_ROOT / checkpoints.get("path", "data/checkpoints"), checkpoints.get("keep", 2))
+                checkpointed = [
+                    (series.algorithm.algorithm, series)
+                    for series in cumulative_wealth_gain + defi_transactions + ([] if tc_pushdown else transaction_counting)
+                ]
+                resume_block = store.resume_run(config["start_block"], config["end_block"], timestamps, checkpointed)
+                if resume_block > config["start_block"]:
+                    print(f"Resumed from checkpoint at block {resume_block}")
+                next_checkpoint = resume_block + checkpoints.get("every", 7200)
+
         end = config["start_block"] + 700
         progress = tqdm(
-                range(config["start_block"],
+                range(resume_block,
                       config["end_block"],
                       config["batch_size"]),
                 desc="Indexing blocks",
@@ -87,7 +171,12 @@ async def main():
                 config["end_block"],
             )
             #collect
+            if columnar:
+                await dc.make_blocks_in_db_available(batch_start, batch_end)
+                continue
             blocks = await dc.get_blocks(batch_start, batch_end, False)
+            if defi_sql:
+                defi_values = await dc.get_defi_values(batch_start, batch_end, False)
 
             # process
             for block in blocks:
@@ -95,146 +184,136 @@ async def main():
                     "timestamp": block[1].timestamp(),
                     "transactions" : block[2] if block[2] is not None else [],
                 }
-                for dt in defi_transactions:
-                    dt.run_on_block(test_block)
-                for wg in cumulative_wealth_gain:
-                    wg.run_on_block(test_block)
-                for tc in transaction_counting:
-                    tc.run_on_block(test_block)
+                if defi_sql:
+                    test_block["defi_value"] = defi_values.get(block[0], 0)
+                if multi_window:
+                    windows.run_on_block(test_block)
+                else:
+                    for dt in defi_transactions:
+                        dt.run_on_block(test_block)
+                    for wg in cumulative_wealth_gain:
+                        wg.run_on_block(test_block)
+                    if not tc_pushdown:
+                        for tc in transaction_counting:
+                            tc.run_on_block(test_block)
                 timestamps.append(datetime.datetime.fromtimestamp(test_block["timestamp"]))
 
+            if store is not None and (batch_end >= next_checkpoint or batch_end == config["end_block"]):
+                store.save_run(config["start_block"], batch_end, timestamps, checkpointed)
+                next_checkpoint = batch_end + checkpoints.get("every", 7200)
+
+        if columnar:
+            now = datetime.datetime.now()
+            analysis = {
+                name: deltas
+                for name, deltas in config["analysis"].items()
+                if not (tc_pushdown and name == "transaction_counting")
+            }
+            if parallel_processes > 0:
+                columns = await dc.get_block_columns(config["start_block"], config["end_block"], False)
+                block_timestamps = columns["timestamp"]
+                series = run_parallel(columns, analysis, parallel_processes)
+                columns = None
+                print(f"All windows in {parallel_processes} processes: {(datetime.datetime.now() - now).total_seconds() * 1000} ms")
+            else:
+                block_timestamps, series = await run_streaming(
+                    dc.iter_block_columns(
+                        config["start_block"],
+                        config["end_block"],
+                        False,
+                        config.get("processing", {}).get("chunk_blocks", 10000),
+                    ),
+                    analysis,
+                )
+                print(f"All windows on streamed block columns: {(datetime.datetime.now() - now).total_seconds() * 1000} ms")
+            cumulative_wealth_gain = series["cumulative_wealth_gain"]
+            defi_transactions = series["defi_transactions"]
+            if not tc_pushdown:
+                transaction_counting = series["transaction_counting"]
+            timestamps = [datetime.datetime.fromtimestamp(t) for t in block_timestamps.tolist()]
+
         # garbage collect
-        for wg in cumulative_wealth_gain:
-            wg.algorithm.algorithm.previous_tx = None
-        for tc in transaction_counting:
-            tc.algorithm.algorithm.previous_tx = None
+        if multi_window:
+            windows.algorithm.blocks = None
+            windows.algorithm.balances = None
+            print(f"\nAverage operation time of all windows\n{average_times({'all windows': windows})}\n")
+        elif not columnar:
+            for wg in cumulative_wealth_gain:
+                wg.algorithm.algorithm.previous_tx = None
+            if not tc_pushdown:
+                for tc in transaction_counting:
+                    tc.algorithm.algorithm.previous_tx = None
         gc.collect()
 
+        if tc_pushdown:
+            now = datetime.datetime.now()
+            _, volume_windows = await dc.get_volume_windows(
+                config["start_block"],
+                config["end_block"],
+                [tc.delta for tc in transaction_counting],
+                False,
+            )
+            for tc, values in zip(transaction_counting, volume_windows):
+                tc.values = values
+            print(f"Total volume of all windows in DuckDB: {(datetime.datetime.now() - now).total_seconds() * 1000} ms")
+
 
         # print to .svg
+        # every trace is downsampled to at most about plot.max_points points
+        plot_config = config.get("plot", {})
+        max_points = plot_config.get("max_points", 2000)
+        downsampling = plot_config.get("downsample", "lttb")
+        specs = []
         for wg, tc, dt in zip(cumulative_wealth_gain, transaction_counting, defi_transactions):
             n_of_slots = wg.delta // 12
             string = seconds_to_string[wg.delta] if wg.delta in seconds_to_string else f"{n_of_slots} Slots"
-            fig = make_subplots(specs=[[{"secondary_y": True}]])
-            # transaction counting trace
-            fig.add_trace(
-                go.Scatter(
-                    x=timestamps[n_of_slots:],
-                    y=tc.values[n_of_slots:],
-                    mode="lines",
-                    name=f"Transaction Volume: {string}",
-                )
-            )
-            # wealth gain trace
-            fig.add_trace(
-                go.Scatter(
-                    x=timestamps[n_of_slots:],
-                    y=wg.values[n_of_slots:],
-                    mode="lines",
-                    name=f"Cumulative Wealth Gain: {string}",
-                )
-            )
-            # defi
-            fig.add_trace(
-                go.Scatter(
-                    x=timestamps[n_of_slots:],
-                    y=dt.values[n_of_slots:],
-                    mode="lines",
-                    name=f"DeFi Transaction Volume: {string}",
-                )
-            )
+            traces = []
+            for series, name in (
+                (tc, "Transaction Volume"),
+                (wg, "Cumulative Wealth Gain"),
+                (dt, "DeFi Transaction Volume"),
+            ):
+                x, y = downsample(timestamps[n_of_slots:], series.values[n_of_slots:], max_points, downsampling)
+                traces.append({"x": x, "y": y, "name": f"{name}: {string}"})
 
-            wg_bu = numpy.array(wg.algorithm.time_build_up_window).mean()
-            wg_sw = numpy.array(wg.algorithm.time_sliding_window).mean()
-            tc_bu = numpy.array(tc.algorithm.time_build_up_window).mean()
-            tc_sw = numpy.array(tc.algorithm.time_sliding_window).mean()
-            df_bu = numpy.array(dt.algorithm.time_build_up_window).mean()
-            df_sw = numpy.array(dt.algorithm.time_sliding_window).mean()
-
-            print(f"""
-                    Average operation time of {n_of_slots}
-                    Cumulative Wealth Gain build-up: {wg_bu.total_seconds() * 1000} ms
-                    Total volume build-up: {tc_bu.total_seconds() * 1000} ms
-                    DeFi Transaction Volume build-up: {df_bu.total_seconds() * 1000} ms
-                    
-                    Cumulative Wealth Gain sliding : {wg_sw.total_seconds() * 1000} ms
-                    Total volume sliding : {tc_sw.total_seconds() * 1000} ms
-                    DeFi Transaction Volume sliding : {df_sw.total_seconds() * 1000} ms
-                  """)
-
-            wg_arr = numpy.asarray(wg.values, dtype=float)
-            tc_arr = numpy.asarray(tc.values, dtype=float)
-            dt_arr = numpy.asarray(dt.values, dtype=float)
+            if not multi_window and not columnar:
+                timed = {"Cumulative Wealth Gain": wg.algorithm}
+                # with tc_pushdown the total volume comes from DuckDB, untimed
+                if not tc_pushdown:
+                    timed["Total volume"] = tc.algorithm
+                timed["DeFi Transaction Volume"] = dt.algorithm
+                print(f"\nAverage operation time of {n_of_slots}\n{average_times(timed)}\n")
 
             window = max(wg.delta // 12, 3600)
-            kernel = numpy.ones(window, dtype=float)
-
-            wg_sum = numpy.convolve(wg_arr, kernel, mode="valid")
-            tc_sum = numpy.convolve(tc_arr, kernel, mode="valid")
-            dt_sum = numpy.convolve(dt_arr, kernel, mode="valid")
-
-            rolling_pct_wg = numpy.divide(
-                wg_sum, tc_sum,
-                out=numpy.full_like(wg_sum, numpy.nan),
-                where=tc_sum != 0
-            ) * 100.0
-            rolling_pct_dt = numpy.divide(
-                dt_sum, tc_sum,
-                out=numpy.full_like(dt_sum, numpy.nan),
-                where=tc_sum != 0
-            ) * 100.0
             cut_timestamps = timestamps[window - 1:]
-            # wealth gain
-            fig.add_trace(
-                go.Scatter(
-                    x=cut_timestamps,
-                    y=rolling_pct_wg,
-                    mode="lines",
-                    name=f"CWG rolling Average in % of total volume: {'one hour' if n_of_slots < 3600 else string}",
-                    line=dict(dash="dot", width=2),
-                ),
-                secondary_y=True
-            )
-
-            fig.add_trace(
-                go.Scatter(
-                    x=cut_timestamps,
-                    y=rolling_pct_dt,
-                    mode="lines",
-                    name=f"DeFi rolling Average in % of total volume: {'one hour' if n_of_slots < 3600 else string}",
-                    line=dict(dash="dot", width=2),
-                ),
-                secondary_y=True
-            )
+            for series, name in ((wg, "CWG"), (dt, "DeFi")):
+                x, y = downsample(cut_timestamps, rolling_percentage(series.values, tc.values, window), max_points, downsampling)
+                traces.append({
+                    "x": x,
+                    "y": y,
+                    "name": f"{name} rolling Average in % of total volume: {'one hour' if n_of_slots < 3600 else string}",
+                    "secondary_y": True,
+                    "dash": "dot",
+                })
 
             max_val = numpy.max(tc.values)
             padding_factor = 1.3
             upper_limit = max_val * padding_factor
 
-            fig.update_yaxes(title_text=f"Window volume in USD",
-                             secondary_y=False,
-                             range=[0,upper_limit]
-                             )
-            fig.update_yaxes(title_text=f"Computed volume % of Transaction Volume",
-                             secondary_y=True,
-                             range=[0,115]
-                             )
-            fig.update_layout(
-                title=f"Algorithm comparison in Δ window {string}",
-                legend_title="Metrics",
-                legend=dict(
-                    orientation="h",
-                    yanchor="top",
-                    y=-0.2,
-                    xanchor="center",
-                    x=0.5
-                ),
-            )
+            specs.append({
+                "path": PROJECT_ROOT / "data" / f"plot_delta_{n_of_slots}.{plot_config.get('format', 'svg')}",
+                "title": f"Algorithm comparison in Δ window {string}",
+                "x_title": "Date",
+                "y_title": "Window volume in USD",
+                "y2_title": "Computed volume % of Transaction Volume",
+                "y_range": [0, upper_limit],
+                "y2_range": [0, 115],
+                "legend_title": "Metrics",
+                "traces": traces,
+            })
 
-            fig.update_xaxes(title_text="Date"
-                             )
-            path = PROJECT_ROOT / "data" / f"plot_delta_{n_of_slots}.svg"
-            fig.write_image(path, scale=1)
+        rendered = render_all(specs, plot_config.get("processes", 0), plot_config.get("webgl", True))
+        print(f"Rendered {len(rendered)} of {len(specs)} plots, the others are unchanged")
     finally:
         await dc.close()
 
@@ -5,7 +5,10 @@ import os
 from tqdm import tqdm
 from dotenv import load_dotenv
 from collect.data_manager import DataCollector
+from collect.db_connection import export_snapshot
 from collect.cancellation_token import CancellationToken
+from collect.ingestion_pipeline import IngestionPipeline
+from collect.parallel_backfill import run_parallel_backfill
 import signal
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -36,24 +39,40 @@ async def main():
     await dc.open()
 
     try:
+        if config.get("prices", {}).get("prefetch", True):
+            print(f"Prefetched {await dc.prefetch_prices(config['start_block'], config['end_block'])} daily prices")
+        batch_starts = range(config["start_block"], config["end_block"] + 1, config["batch_size"])
+        batches = [
+            (batch_start, min(batch_start + config["batch_size"], config["end_block"]))
+            for batch_start in batch_starts
+        ]
         progress = tqdm(
-                range(config["start_block"], config["end_block"] + 1, config["batch_size"]),
+                total=len(batches),
                 desc="Indexing blocks",
                 unit="batch",
         )
 
-        for batch_start in progress:
-            if cancellation_token.is_canceled():
-                break
+        pipeline_config = config.get("pipeline", {})
+        pipeline = IngestionPipeline(
+            dc,
+            cancellation_token,
+            fetch_workers=pipeline_config.get("fetch_workers", 4),
+            decode_workers=pipeline_config.get("decode_workers", 1),
+            queue_size=pipeline_config.get("queue_size", 8),
+        )
+        await pipeline.run(batches, progress)
+        progress.close()
+        print(f"Average queue depths: {pipeline.average_queue_depths()}")
 
-            batch_end = min(
-                batch_start + config["batch_size"],
-                config["end_block"],
-            )
-            await dc.make_blocks_in_db_available(batch_start,batch_end)
+        if config.get("analysis_db", {}).get("export", False):
+            export_snapshot(dc.db, PROJECT_ROOT / config["analysis_db"].get("path", "data/analysis.duckdb"))
+            print("Exported the analysis database.")
 
     finally:
         await dc.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if get_config().get("backfill", {}).get("workers", 0) > 0:
+        run_parallel_backfill(get_config())
+    else:
+        asyncio.run(main())
\ No newline at end of file
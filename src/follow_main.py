@@ -0,0 +1,100 @@
+import asyncio
+import functools
+from pathlib import Path
+import yaml
+import os
+import numpy
+from dotenv import load_dotenv
+from collect.data_manager import DataCollector
+from collect.cancellation_token import CancellationToken
+from collect.chain_follower import ChainFollower
+from processing.alg_cumulative_wealth_gain import CumulativeWealthGain
+from processing.alg_cumulative_wealth_gain_array import CumulativeWealthGainArray
+from processing.alg_transaction_counting import TransactionCounting
+from processing.alg_defi_transactions import DefiTransactions
+import signal
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SECONDS_PER_SLOT = 12
+
+def get_config() -> dict:
+    load_dotenv(PROJECT_ROOT / ".env")
+    path = PROJECT_ROOT / "config" / "config.yaml"
+    with path.open("r") as f:
+        config = yaml.safe_load(f)
+    config["COIN_GECKO_API_KEY"] = os.getenv("COIN_GECKO_API_KEY")
+    config["RCP_URL"] = os.getenv("RCP_URL")
+    return config
+
+def print_block(number, results, latency):
+    metrics = ", ".join(f"{name}: {value:,.0f}" for name, value in results.items())
+    print(f"Block {number} ({latency:.1f} s) {metrics}")
+
+async def main():
+    cancellation_token = CancellationToken()
+    config = get_config()
+    follow_config = config.get("follow", {})
+    max_reorg_depth = follow_config.get("max_reorg_depth", 64)
+    dc = DataCollector(config=config)
+
+    loop = asyncio.get_running_loop()
+
+    def handle_interrupt():
+        print("\nInterrupt received — finishing current block and exiting…")
+        cancellation_token.cancel()
+
+    loop.add_signal_handler(signal.SIGINT, handle_interrupt)
+    loop.add_signal_handler(signal.SIGTERM, handle_interrupt)
+
+    await dc.open()
+
+    try:
+        processing = config.get("processing", {})
+        if processing.get("cwg_engine", "dict") == "array":
+            cwg_engine = CumulativeWealthGainArray
+        else:
+            cwg_engine = functools.partial(
+                CumulativeWealthGain,
+                epsilon=processing.get("cwg_epsilon", 1e-6),
+                max_bytes=processing.get("cwg_max_bytes"),
+            )
+        algorithms = {}
+        for n in config["analysis"]["cumulative_wealth_gain"]:
+            algorithms[f"CWG {n}s"] = cwg_engine(n, max_reorg_depth)
+        for n in config["analysis"]["transaction_counting"]:
+            algorithms[f"Volume {n}s"] = TransactionCounting(n, max_reorg_depth)
+        for n in config["analysis"]["defi_transactions"]:
+            algorithms[f"DeFi {n}s"] = DefiTransactions(n, max_reorg_depth)
+
+        follower = ChainFollower(
+            dc,
+            algorithms,
+            cancellation_token,
+            poll_interval=follow_config.get("poll_interval", 1),
+            max_reorg_depth=max_reorg_depth,
+            batch_size=config["batch_size"],
+            on_block=print_block,
+        )
+        # continue after the last followed block, otherwise start at the current head
+        start_block = follower.resume_block() or await follower.get_head()
+        # the largest window has to be filled before the metrics mean anything
+        warm_up_blocks = max(
+            config["analysis"]["cumulative_wealth_gain"]
+            + config["analysis"]["transaction_counting"]
+            + config["analysis"]["defi_transactions"]
+        ) // SECONDS_PER_SLOT
+        if config.get("prices", {}).get("prefetch", True):
+            print(f"Prefetched {await dc.prefetch_prices(start_block - warm_up_blocks, start_block)} daily prices")
+        print(f"Warming up with blocks {start_block - warm_up_blocks} to {start_block - 1}")
+        await follower.warm_up(start_block - warm_up_blocks, start_block)
+        print(f"Following the chain from block {start_block}")
+        await follower.follow(start_block)
+
+        if follower.latencies:
+            latencies = numpy.array(follower.latencies)
+            print(f"Latency from block to metrics: median {numpy.median(latencies):.2f} s, max {latencies.max():.2f} s")
+    finally:
+        await dc.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
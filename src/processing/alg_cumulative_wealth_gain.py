@@ -1,47 +1,144 @@
+import sys
 from collections import deque
 
+# rough CPython sizes for memory_usage
+ADDRESS_BYTES = sys.getsizeof("0x" + "0" * 40)
+FLOAT_BYTES = sys.getsizeof(0.0)
+# one (from, to, usd_value) tuple in a window block, with its list slot
+TRANSFER_BYTES = sys.getsizeof((None, None, None)) + 8 + FLOAT_BYTES + 2 * ADDRESS_BYTES
+BLOCK_BYTES = sys.getsizeof({"timestamp": 0, "transactions": [], "cached_gain": 0}) + sys.getsizeof([]) + 2 * FLOAT_BYTES
+
 
 class CumulativeWealthGain:
-    def __init__(self, two_delta):
+    def __init__(self, two_delta, revert_depth=0, epsilon=1e-6, max_bytes=None):
         self.two_delta = two_delta
         self.gain_total = 0
         self.vertex_map = {}
         self.previous_tx = deque()
+        # blocks evicted by each of the last revert_depth blocks, so that they can be reverted after a reorg
+        self.evicted = deque(maxlen=revert_depth)
+        # balances within epsilon (USD) of zero are settled and removed from vertex_map, it only holds
+        # the addresses with a balance in the current window
+        self.epsilon = epsilon
+        # soft cap of memory_usage()["bytes"], see check_memory
+        self.max_bytes = max_bytes
+        self.memory_warned = False
+        self.window_transfers = 0
 
     def calc_gain(self, v1, v2, val):
+        if v1 == v2:
+            # a self transfer moves no wealth, and only this way rollback_txs is its exact inverse
+            return 0
         u = self.vertex_map.get(v1, 0)
         v = self.vertex_map.get(v2, 0)
 
         delta_gain = (max(0, u + val) + max(0, v - val)) - (max(0, u) + max(0, v))
 
-        self.vertex_map[v1] = u + val
-        self.vertex_map[v2] = v - val
+        self.set_balance(v1, u + val)
+        self.set_balance(v2, v - val)
         return delta_gain
 
+    def set_balance(self, vertex, balance):
+        if -self.epsilon <= balance <= self.epsilon:
+            self.vertex_map.pop(vertex, None)
+        else:
+            self.vertex_map[vertex] = balance
+
     def rollback_txs(self, block):
-        for tx in block["transactions"]:
-            self.calc_gain(tx["to"], tx["from"], tx["usd_value"])
+        for from_addr, to_addr, usd_value in block["transactions"]:
+            self.calc_gain(to_addr, from_addr, usd_value)
         self.gain_total -= block["cached_gain"]
+        self.window_transfers -= len(block["transactions"])
 
+    def restore_txs(self, block):
+        # inverse of rollback_txs, for blocks that return into the window
+        for from_addr, to_addr, usd_value in block["transactions"]:
+            self.calc_gain(from_addr, to_addr, usd_value)
+        self.gain_total += block["cached_gain"]
+        self.window_transfers += len(block["transactions"])
 
     def execute_txs(self, block):
         block_gain = 0
-        for tx in block["transactions"]:
-            g = self.calc_gain(tx["from"], tx["to"], tx["usd_value"])
+        # the window keeps (from, to, usd_value) only instead of the whole transaction dicts
+        transfers = [(tx["from"], tx["to"], tx["usd_value"]) for tx in block["transactions"]]
+        for from_addr, to_addr, usd_value in transfers:
+            g = self.calc_gain(from_addr, to_addr, usd_value)
             block_gain += g
         self.previous_tx.append({
             "timestamp": block["timestamp"],
-            "transactions": block["transactions"],
+            "transactions": transfers,
             "cached_gain": block_gain,
         })
         self.gain_total += block_gain
+        self.window_transfers += len(transfers)
 
     def run_on_block(self, block: dict) -> int:
         current_time = block["timestamp"]
         cutoff_time = current_time - self.two_delta
 
+        evicted = []
         while self.previous_tx and self.previous_tx[0]["timestamp"] < cutoff_time:
-            self.rollback_txs(self.previous_tx.popleft())
+            evicted.append(self.previous_tx.popleft())
+            self.rollback_txs(evicted[-1])
         self.execute_txs(block)
+        self.evicted.append(evicted)
+        if self.max_bytes is not None:
+            self.check_memory()
+
+        return self.gain_total
+
+    def revert_last_block(self) -> int:
+        # undoes the last run_on_block, e.g. when its block was reorged out
+        if not self.evicted:
+            raise ValueError("no block left to revert, increase revert_depth")
+        self.rollback_txs(self.previous_tx.pop())
+        for block in reversed(self.evicted.pop()):
+            self.restore_txs(block)
+            self.previous_tx.appendleft(block)
+        return self.gain_total
+
+    def state_dict(self) -> dict:
+        # window contents, balances and total for processing.checkpoint, the revert journal is not kept
+        return {
+            "two_delta": self.two_delta,
+            "gain_total": self.gain_total,
+            "vertex_map": self.vertex_map,
+            "previous_tx": list(self.previous_tx),
+            "window_transfers": self.window_transfers,
+        }
+
+    def load_state_dict(self, state: dict):
+        if state["two_delta"] != self.two_delta:
+            raise ValueError(f"checkpoint of a {state['two_delta']} s window loaded into a {self.two_delta} s window")
+        self.gain_total = state["gain_total"]
+        self.vertex_map = dict(state["vertex_map"])
+        self.previous_tx = deque(state["previous_tx"])
+        self.window_transfers = state["window_transfers"]
+        self.evicted.clear()
+
+    def memory_usage(self) -> dict:
+        # estimated from counts, O(1)
+        vertices = len(self.vertex_map)
+        blocks = len(self.previous_tx)
+        return {
+            "vertices": vertices,
+            "blocks": blocks,
+            "transfers": self.window_transfers,
+            "bytes": sys.getsizeof(self.vertex_map)
+                     + vertices * (ADDRESS_BYTES + FLOAT_BYTES)
+                     + blocks * BLOCK_BYTES
+                     + self.window_transfers * TRANSFER_BYTES,
+        }
 
-        return self.gain_total
\ No newline at end of file
+    def check_memory(self):
+        # A dict does not shrink when entries are removed. Above the cap vertex_map is rebuilt to release
+        # the slots of settled addresses, if that is not enough the window itself is too large for the cap
+        usage = self.memory_usage()
+        if usage["bytes"] <= self.max_bytes:
+            return
+        if sys.getsizeof(self.vertex_map) > 2 * sys.getsizeof(dict.fromkeys(range(usage["vertices"]))):
+            self.vertex_map = dict(self.vertex_map)
+            usage = self.memory_usage()
+        if usage["bytes"] > self.max_bytes and not self.memory_warned:
+            self.memory_warned = True
+            print(f"Window of {self.two_delta} s exceeds its memory cap: {usage}")
@@ -0,0 +1,158 @@
+import sys
+from collections import deque
+import numpy as np
+from processing.alg_cumulative_wealth_gain import ADDRESS_BYTES
+
+
+class AddressIndex:
+    # interns addresses (or any hashable vertex key) to dense integer ids 0, 1, 2, ...
+    def __init__(self):
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, addresses):
+        ids = self.ids
+        return np.fromiter(
+            (ids.setdefault(address, len(ids)) for address in addresses),
+            dtype=np.int64,
+            count=len(addresses),
+        )
+
+
+class CumulativeWealthGainArray:
+    # Same results as CumulativeWealthGain, with the balances in a NumPy float64 array indexed by dense
+    # address ids. A block is applied as one vectorized update of the addresses it touches:
+    # balance[from] += value, balance[to] -= value, and its gain is
+    #   sum(max(0, balance after)) - sum(max(0, balance before)) over those addresses,
+    # which equals the sum of the per transfer gains of calc_gain. The window keeps only the
+    # per address balance change of each block, not its transactions.
+    def __init__(self, two_delta, revert_depth=0, initial_size=1 << 16):
+        self.two_delta = two_delta
+        self.gain_total = 0
+        self.balances = np.zeros(initial_size, dtype=np.float64)
+        self.addresses = AddressIndex()
+        # (timestamp, address ids, balance changes, cached gain) per block in the window
+        self.previous_tx = deque()
+        # blocks evicted by each of the last revert_depth blocks, see CumulativeWealthGain
+        self.evicted = deque(maxlen=revert_depth)
+
+    def grow(self, size):
+        if size > len(self.balances):
+            balances = np.zeros(max(size, 2 * len(self.balances)), dtype=np.float64)
+            balances[:len(self.balances)] = self.balances
+            self.balances = balances
+
+    @staticmethod
+    def net_changes(from_ids, to_ids, usd_values):
+        # sorted unique ids of a block and the summed balance change of each
+        vertices = np.concatenate((from_ids, to_ids))
+        order = np.argsort(vertices, kind="stable")
+        vertices = vertices[order]
+        first = np.empty(len(vertices), dtype=bool)
+        first[0] = True
+        np.not_equal(vertices[1:], vertices[:-1], out=first[1:])
+        starts = np.flatnonzero(first)
+        delta = np.add.reduceat(np.concatenate((usd_values, -usd_values))[order], starts)
+        return vertices[starts], delta
+
+    def apply(self, ids, delta):
+        # returns the gain of adding delta to the balances of the unique ids
+        before = self.balances[ids]
+        after = before + delta
+        self.balances[ids] = after
+        return np.maximum(after, 0).sum() - np.maximum(before, 0).sum()
+
+    def rollback(self, entry):
+        self.balances[entry[1]] -= entry[2]
+        self.gain_total -= entry[3]
+
+    def restore(self, entry):
+        # inverse of rollback, for blocks that return into the window
+        self.balances[entry[1]] += entry[2]
+        self.gain_total += entry[3]
+
+    def run_on_columns(self, timestamp, from_ids, to_ids, usd_values) -> float:
+        # one block as columns: integer address ids (e.g. the interned ids of the compact layout) and usd values
+        cutoff_time = timestamp - self.two_delta
+        evicted = []
+        while self.previous_tx and self.previous_tx[0][0] < cutoff_time:
+            evicted.append(self.previous_tx.popleft())
+            self.rollback(evicted[-1])
+
+        if len(usd_values) > 0:
+            ids, delta = self.net_changes(from_ids, to_ids, usd_values)
+            self.grow(int(ids[-1]) + 1)
+            block_gain = self.apply(ids, delta)
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            delta = np.empty(0, dtype=np.float64)
+            block_gain = 0.0
+
+        self.previous_tx.append((timestamp, ids, delta, block_gain))
+        self.gain_total += block_gain
+        self.evicted.append(evicted)
+        return self.gain_total
+
+    def run_on_block(self, block: dict) -> float:
+        # drop-in for CumulativeWealthGain.run_on_block, interns the addresses of the transaction dicts
+        transactions = block["transactions"]
+        usd_values = np.fromiter(
+            (tx["usd_value"] for tx in transactions),
+            dtype=np.float64,
+            count=len(transactions),
+        )
+        return self.run_on_columns(
+            block["timestamp"],
+            self.addresses.intern([tx["from"] for tx in transactions]),
+            self.addresses.intern([tx["to"] for tx in transactions]),
+            usd_values,
+        )
+
+    def state_dict(self) -> dict:
+        # see CumulativeWealthGain.state_dict, the addresses are stored in id order
+        return {
+            "two_delta": self.two_delta,
+            "gain_total": self.gain_total,
+            "addresses": list(self.addresses.ids),
+            "balances": self.balances[:len(self.addresses)].copy(),
+            "previous_tx": list(self.previous_tx),
+        }
+
+    def load_state_dict(self, state: dict):
+        if state["two_delta"] != self.two_delta:
+            raise ValueError(f"checkpoint of a {state['two_delta']} s window loaded into a {self.two_delta} s window")
+        self.gain_total = state["gain_total"]
+        self.addresses = AddressIndex()
+        self.addresses.intern(state["addresses"])
+        self.balances = np.zeros(max(len(self.balances), len(state["balances"])), dtype=np.float64)
+        self.balances[:len(state["balances"])] = state["balances"]
+        self.previous_tx = deque(state["previous_tx"])
+        self.evicted.clear()
+
+    def memory_usage(self) -> dict:
+        # same keys as CumulativeWealthGain.memory_usage, transfers are the (id, change) pairs of the window
+        # blocks and the address index is never evicted
+        blocks = len(self.previous_tx)
+        transfers = sum(len(entry[1]) for entry in self.previous_tx)
+        return {
+            "vertices": len(self.addresses),
+            "blocks": blocks,
+            "transfers": transfers,
+            "bytes": self.balances.nbytes
+                     + sys.getsizeof(self.addresses.ids)
+                     + len(self.addresses) * ADDRESS_BYTES
+                     + blocks * sys.getsizeof((0, None, None, 0))
+                     + transfers * 16,
+        }
+
+    def revert_last_block(self) -> float:
+        # undoes the last run_on_block, e.g. when its block was reorged out
+        if not self.evicted:
+            raise ValueError("no block left to revert, increase revert_depth")
+        self.rollback(self.previous_tx.pop())
+        for entry in reversed(self.evicted.pop()):
+            self.restore(entry)
+            self.previous_tx.appendleft(entry)
+        return self.gain_total
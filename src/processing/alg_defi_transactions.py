@@ -1,36 +1,89 @@
 from collections import defaultdict
 from collections import deque
-from processing.alg_cumulative_wealth_gain import CumulativeWealthGain
+import numpy as np
 
 class DefiTransactions:
-    def __init__(self, two_delta):
+    def __init__(self, two_delta, revert_depth=0):
         self.two_delta = two_delta
         self.gain_total = 0
         self.previous_tx = deque()
+        # (timestamp, value) entries evicted by each of the last revert_depth blocks
+        self.evicted = deque(maxlen=revert_depth)
 
     def run_on_block(self, block: dict) -> int:
+        return self.run_on_value(block["timestamp"], self.block_value(block))
+
+    def run_on_value(self, current_time, total_value) -> int:
+        # one block given by its DeFi value, e.g. from block_value_columns
         # remove old transactions
-        current_time = block["timestamp"]
         cutoff_time = current_time - self.two_delta
+        evicted = []
         while self.previous_tx and self.previous_tx[0][0] < cutoff_time:
             self.gain_total = self.gain_total - self.previous_tx[0][1]
-            self.previous_tx.popleft()
+            evicted.append(self.previous_tx.popleft())
+        self.evicted.append(evicted)
 
         # add new transaction
-        grouped_tx = defaultdict(list)
+        self.previous_tx.append((current_time, total_value))
+        self.gain_total = self.gain_total + total_value
+        return self.gain_total
+
+    @staticmethod
+    def block_value(block: dict):
+        # the positive net flow of each transaction, summed over the block. Same value as a fresh
+        # CumulativeWealthGain per transaction hash: its gain is the sum of the positive balances it ends with
+        if "defi_value" in block:
+            # precomputed, e.g. by DataCollector.get_defi_values
+            return block["defi_value"]
+        net = defaultdict(float)
         for tx in block['transactions']:
-            if tx["usd_value"] is None:
+            value = tx["usd_value"]
+            if value is None or tx["from"] == tx["to"]:
                 continue
-            grouped_tx[tx["hash"]].append(tx)
+            net[(tx["hash"], tx["from"])] += value
+            net[(tx["hash"], tx["to"])] -= value
+        return sum(value for value in net.values() if value > 0)
 
-        total_value = 0
-        for hash, txs in grouped_tx.items():
-            cumulative_wealth_gain = CumulativeWealthGain(24)
-            total_value = total_value + cumulative_wealth_gain.run_on_block({
-                "timestamp": block["timestamp"],
-                "transactions": txs if txs is not None else [],
-            })
+    @staticmethod
+    def block_value_columns(hash_ids, from_ids, to_ids, usd_values):
+        # block_value for column arrays of integer ids, as one group by over (hash id, address id)
+        keep = ~np.isnan(usd_values) & (from_ids != to_ids)
+        if not keep.any():
+            return 0.0
+        hashes = np.concatenate((hash_ids[keep], hash_ids[keep]))
+        addresses = np.concatenate((from_ids[keep], to_ids[keep]))
+        values = np.concatenate((usd_values[keep], -usd_values[keep]))
+        order = np.lexsort((addresses, hashes))
+        hashes = hashes[order]
+        addresses = addresses[order]
+        first = np.empty(len(order), dtype=bool)
+        first[0] = True
+        first[1:] = (hashes[1:] != hashes[:-1]) | (addresses[1:] != addresses[:-1])
+        net = np.add.reduceat(values[order], np.flatnonzero(first))
+        return float(net[net > 0].sum())
 
-        self.previous_tx.append((current_time, total_value))
-        self.gain_total = self.gain_total + total_value
+    def state_dict(self) -> dict:
+        # same layout as TransactionCounting.state_dict
+        return {
+            "two_delta": self.two_delta,
+            "gain_total": self.gain_total,
+            "timestamps": np.array([entry[0] for entry in self.previous_tx], dtype=np.float64),
+            "values": np.array([entry[1] for entry in self.previous_tx], dtype=np.float64),
+        }
+
+    def load_state_dict(self, state: dict):
+        if state["two_delta"] != self.two_delta:
+            raise ValueError(f"checkpoint of a {state['two_delta']} s window loaded into a {self.two_delta} s window")
+        self.gain_total = state["gain_total"]
+        self.previous_tx = deque(zip(state["timestamps"].tolist(), state["values"].tolist()))
+        self.evicted.clear()
+
+    def revert_last_block(self) -> int:
+        # undoes the last run_on_block, e.g. when its block was reorged out
+        if not self.evicted:
+            raise ValueError("no block left to revert, increase revert_depth")
+        self.gain_total = self.gain_total - self.previous_tx.pop()[1]
+        for entry in reversed(self.evicted.pop()):
+            self.gain_total = self.gain_total + entry[1]
+            self.previous_tx.appendleft(entry)
         return self.gain_total
@@ -1,21 +1,54 @@
 from collections import deque
+import numpy as np
 
 class TransactionCounting:
-    def __init__(self, two_delta ):
+    def __init__(self, two_delta, revert_depth=0):
         self.two_delta = two_delta
         self.gain_total = 0
         self.previous_tx = deque()
+        # (timestamp, value) entries evicted by each of the last revert_depth blocks
+        self.evicted = deque(maxlen=revert_depth)
 
     def run_on_block(self, block: dict) -> int:
+        return self.run_on_value(block["timestamp"], sum(tx['usd_value'] for tx in block['transactions']))
+
+    def run_on_value(self, current_time, transaction_sum) -> int:
+        # one block given by its transaction sum, e.g. from column arrays
         #remove old transactions
-        current_time = block["timestamp"]
         cutoff_time = current_time - self.two_delta
+        evicted = []
         while self.previous_tx and self.previous_tx[0][0] < cutoff_time:
             self.gain_total = self.gain_total - self.previous_tx[0][1]
-            self.previous_tx.popleft()
+            evicted.append(self.previous_tx.popleft())
+        self.evicted.append(evicted)
 
         #add new transaction
-        transaction_sum = sum(tx['usd_value'] for tx in block['transactions'])
         self.previous_tx.append((current_time, transaction_sum))
         self.gain_total = self.gain_total + transaction_sum
-        return self.gain_total
\ No newline at end of file
+        return self.gain_total
+
+    def revert_last_block(self) -> int:
+        # undoes the last run_on_block, e.g. when its block was reorged out
+        if not self.evicted:
+            raise ValueError("no block left to revert, increase revert_depth")
+        self.gain_total = self.gain_total - self.previous_tx.pop()[1]
+        for entry in reversed(self.evicted.pop()):
+            self.gain_total = self.gain_total + entry[1]
+            self.previous_tx.appendleft(entry)
+        return self.gain_total
+
+    def state_dict(self) -> dict:
+        # window contents and total for processing.checkpoint, the revert journal is not kept
+        return {
+            "two_delta": self.two_delta,
+            "gain_total": self.gain_total,
+            "timestamps": np.array([entry[0] for entry in self.previous_tx], dtype=np.float64),
+            "values": np.array([entry[1] for entry in self.previous_tx], dtype=np.float64),
+        }
+
+    def load_state_dict(self, state: dict):
+        if state["two_delta"] != self.two_delta:
+            raise ValueError(f"checkpoint of a {state['two_delta']} s window loaded into a {self.two_delta} s window")
+        self.gain_total = state["gain_total"]
+        self.previous_tx = deque(zip(state["timestamps"].tolist(), state["values"].tolist()))
+        self.evicted.clear()
@@ -0,0 +1,66 @@
+import numpy as np
+from processing.alg_cumulative_wealth_gain_array import CumulativeWealthGainArray
+from processing.alg_transaction_counting import TransactionCounting
+from processing.alg_defi_transactions import DefiTransactions
+from processing.multi_window import WindowSeries
+
+# the algorithm of each analysis config key when running on block columns
+ALGORITHMS = {
+    "cumulative_wealth_gain": CumulativeWealthGainArray,
+    "transaction_counting": TransactionCounting,
+    "defi_transactions": DefiTransactions,
+}
+
+
+def run_on_columns(instance, columns):
+    # Feeds the blocks of one chunk of DataCollector.get_block_columns / iter_block_columns to an algorithm
+    # instance, returns its value after every block. No per transfer Python objects are created.
+    timestamps = columns["timestamp"].tolist()
+    offsets = columns["offsets"]
+    values = np.empty(len(timestamps), dtype=np.float64)
+    if isinstance(instance, CumulativeWealthGainArray):
+        from_ids, to_ids = columns["from_ids"], columns["to_ids"]
+        # unpriced transfers move no value, as in TransactionCounting
+        usd_values = np.nan_to_num(columns["usd_value"])
+        for i, timestamp in enumerate(timestamps):
+            start, end = offsets[i], offsets[i + 1]
+            values[i] = instance.run_on_columns(timestamp, from_ids[start:end], to_ids[start:end], usd_values[start:end])
+    elif isinstance(instance, TransactionCounting):
+        cumulative = np.concatenate(([0.0], np.cumsum(np.nan_to_num(columns["usd_value"]))))
+        block_sums = (cumulative[offsets[1:]] - cumulative[offsets[:-1]]).tolist()
+        for i, timestamp in enumerate(timestamps):
+            values[i] = instance.run_on_value(timestamp, block_sums[i])
+    elif isinstance(instance, DefiTransactions):
+        hash_ids, from_ids, to_ids, usd_values = columns["hash_ids"], columns["from_ids"], columns["to_ids"], columns["usd_value"]
+        for i, timestamp in enumerate(timestamps):
+            start, end = offsets[i], offsets[i + 1]
+            block_value = DefiTransactions.block_value_columns(
+                hash_ids[start:end], from_ids[start:end], to_ids[start:end], usd_values[start:end]
+            ) if end > start else 0.0
+            values[i] = instance.run_on_value(timestamp, block_value)
+    else:
+        raise TypeError(f"{type(instance).__name__} can not run on block columns")
+    return values
+
+
+async def run_streaming(chunks, analysis):
+    # Evaluates every (algorithm, delta) pair of the analysis config section over the chunks of
+    # DataCollector.iter_block_columns, one chunk in memory at a time.
+    # Returns the block timestamps and {algorithm: [WindowSeries, ...]} like run_parallel
+    instances = {name: [ALGORITHMS[name](delta) for delta in deltas] for name, deltas in analysis.items()}
+    parts = {name: [[] for _ in deltas] for name, deltas in analysis.items()}
+    timestamps = []
+    async for columns in chunks:
+        timestamps.append(columns["timestamp"])
+        for name in analysis:
+            for instance, values in zip(instances[name], parts[name]):
+                values.append(run_on_columns(instance, columns))
+
+    series = {}
+    for name, deltas in analysis.items():
+        series[name] = []
+        for delta, values in zip(deltas, parts[name]):
+            window = WindowSeries(delta)
+            window.values = np.concatenate(values) if values else np.empty(0, dtype=np.float64)
+            series[name].append(window)
+    return np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.float64), series
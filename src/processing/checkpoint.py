@@ -0,0 +1,69 @@
+import datetime
+import gzip
+import os
+import pickle
+from pathlib import Path
+import numpy as np
+
+
+class CheckpointStore:
+    # Gzip compressed pickles of the algorithm state (state_dict) and of the values computed so far.
+    # A file is keyed by algorithm, delta, the start block of the run and the block it ends before:
+    #   {algorithm}_{delta}_{start block}_{end block}.pkl.gz
+    # so a run with the same start block resumes from the latest end block all its algorithms share.
+    def __init__(self, path, keep=2):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # checkpoints kept per algorithm and delta, older ones are deleted on save
+        self.keep = keep
+
+    def _file(self, name, delta, start_block, end_block):
+        return self.path / f"{name}_{delta}_{start_block}_{end_block}.pkl.gz"
+
+    def end_blocks(self, name, delta, start_block):
+        prefix = f"{name}_{delta}_{start_block}_"
+        return sorted(
+            int(file.name[len(prefix):-len(".pkl.gz")])
+            for file in self.path.glob(f"{prefix}*.pkl.gz")
+        )
+
+    def save(self, name, delta, start_block, end_block, state, values):
+        file = self._file(name, delta, start_block, end_block)
+        tmp = file.with_suffix(".tmp")
+        with gzip.open(tmp, "wb", compresslevel=1) as f:
+            pickle.dump({"state": state, "values": np.asarray(values, dtype=np.float64)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, file)
+        for old in self.end_blocks(name, delta, start_block)[:-self.keep]:
+            self._file(name, delta, start_block, old).unlink()
+
+    def load(self, name, delta, start_block, end_block):
+        with gzip.open(self._file(name, delta, start_block, end_block), "rb") as f:
+            return pickle.load(f)
+
+    def save_run(self, start_block, end_block, timestamps, series):
+        # series: (algorithm, values holder with .delta and .values) pairs, e.g. from collect_and_plot_main
+        self.save("timestamps", 0, start_block, end_block, None, [t.timestamp() for t in timestamps])
+        for algorithm, values in series:
+            self.save(type(algorithm).__name__, values.delta, start_block, end_block, algorithm.state_dict(), values.values)
+
+    def resume_run(self, start_block, end_block, timestamps, series):
+        # loads the latest checkpoint at or before end_block that exists for all series,
+        # returns the block to continue from (start_block if there is none)
+        keys = [("timestamps", 0)] + [(type(algorithm).__name__, values.delta) for algorithm, values in series]
+        common = set(self.end_blocks(*keys[0], start_block))
+        for key in keys[1:]:
+            common &= set(self.end_blocks(*key, start_block))
+        common = [block for block in common if block <= end_block]
+        if not common:
+            return start_block
+        block = max(common)
+
+        timestamps[:] = [
+            datetime.datetime.fromtimestamp(t)
+            for t in self.load("timestamps", 0, start_block, block)["values"].tolist()
+        ]
+        for algorithm, values in series:
+            checkpoint = self.load(type(algorithm).__name__, values.delta, start_block, block)
+            algorithm.load_state_dict(checkpoint["state"])
+            values.values = checkpoint["values"].tolist()
+        return block
@@ -0,0 +1,120 @@
+import numpy as np
+from processing.alg_cumulative_wealth_gain_array import AddressIndex, CumulativeWealthGainArray
+from processing.alg_defi_transactions import DefiTransactions
+
+
+class WindowSeries:
+    # the values of one algorithm and delta, shaped like analysis.value_comparision.ValueComparison
+    def __init__(self, delta):
+        self.delta = delta
+        self.values = []
+
+
+class MultiWindow:
+    # Evaluates TransactionCounting, DefiTransactions and CumulativeWealthGain for all deltas in one pass.
+    # The per block values (transaction sum, DeFi value, balance change per address) are computed once and
+    # kept in one buffer that every delta reads through its own eviction cursor, so the buffer holds the
+    # blocks of the largest window only. The CWG balances of all deltas are the rows of one array and a
+    # block is applied to every window with one vectorized update.
+    def __init__(self, cumulative_wealth_gain, transaction_counting, defi_transactions, initial_size=1 << 16):
+        # the arguments are the deltas of each algorithm, like the analysis section of the config
+        self.deltas = sorted(set(cumulative_wealth_gain) | set(transaction_counting) | set(defi_transactions))
+        # absolute index of the oldest block in the window of each delta
+        self.cursors = [0] * len(self.deltas)
+        self.transaction_counting = np.zeros(len(self.deltas))
+        self.defi_transactions = np.zeros(len(self.deltas))
+
+        cwg_deltas = sorted(set(cumulative_wealth_gain))
+        # balances row of each delta, None for deltas without CWG
+        self.cwg_rows = [
+            cwg_deltas.index(delta) if delta in cwg_deltas else None
+            for delta in self.deltas
+        ]
+        self.cumulative_wealth_gain = np.zeros(len(cwg_deltas))
+        self.balances = np.zeros((len(cwg_deltas), initial_size), dtype=np.float64)
+        self.addresses = AddressIndex()
+
+        # (timestamp, transaction sum, DeFi value, address ids, balance changes, CWG gain per row) per block
+        self.blocks = []
+        # absolute index of blocks[0]
+        self.offset = 0
+
+        self.series = {
+            "cumulative_wealth_gain": [WindowSeries(delta) for delta in cumulative_wealth_gain],
+            "transaction_counting": [WindowSeries(delta) for delta in transaction_counting],
+            "defi_transactions": [WindowSeries(delta) for delta in defi_transactions],
+        }
+        # (values, totals, index into totals) of every series, appended to after each block
+        self.outputs = [
+            (series.values, self.cumulative_wealth_gain, self.cwg_rows[self.deltas.index(series.delta)])
+            for series in self.series["cumulative_wealth_gain"]
+        ] + [
+            (series.values, totals, self.deltas.index(series.delta))
+            for name, totals in (
+                ("transaction_counting", self.transaction_counting),
+                ("defi_transactions", self.defi_transactions),
+            )
+            for series in self.series[name]
+        ]
+
+    def grow(self, size):
+        if size > self.balances.shape[1]:
+            balances = np.zeros((self.balances.shape[0], max(size, 2 * self.balances.shape[1])), dtype=np.float64)
+            balances[:, :self.balances.shape[1]] = self.balances
+            self.balances = balances
+
+    def evict(self, timestamp):
+        end = self.offset + len(self.blocks)
+        for i, delta in enumerate(self.deltas):
+            cutoff_time = timestamp - delta
+            row = self.cwg_rows[i]
+            while self.cursors[i] < end and self.blocks[self.cursors[i] - self.offset][0] < cutoff_time:
+                _, transaction_sum, defi_value, ids, changes, gains = self.blocks[self.cursors[i] - self.offset]
+                self.transaction_counting[i] -= transaction_sum
+                self.defi_transactions[i] -= defi_value
+                if row is not None:
+                    self.balances[row, ids] -= changes
+                    self.cumulative_wealth_gain[row] -= gains[row]
+                self.cursors[i] += 1
+
+        # blocks before the oldest cursor are out of every window, dropped in chunks to keep appends O(1)
+        unused = min(self.cursors) - self.offset
+        if unused > 1024 and unused * 2 > len(self.blocks):
+            del self.blocks[:unused]
+            self.offset += unused
+
+    def run_on_block(self, block: dict):
+        timestamp = block["timestamp"]
+        transactions = block["transactions"]
+        self.evict(timestamp)
+
+        transaction_sum = sum(tx["usd_value"] for tx in transactions)
+        defi_value = DefiTransactions.block_value(block)
+        if transactions:
+            usd_values = np.fromiter(
+                (tx["usd_value"] for tx in transactions),
+                dtype=np.float64,
+                count=len(transactions),
+            )
+            ids, changes = CumulativeWealthGainArray.net_changes(
+                self.addresses.intern([tx["from"] for tx in transactions]),
+                self.addresses.intern([tx["to"] for tx in transactions]),
+                usd_values,
+            )
+            self.grow(int(ids[-1]) + 1)
+            before = self.balances[:, ids]
+            after = before + changes
+            self.balances[:, ids] = after
+            gains = np.maximum(after, 0).sum(axis=1) - np.maximum(before, 0).sum(axis=1)
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            changes = np.empty(0, dtype=np.float64)
+            gains = np.zeros(len(self.cumulative_wealth_gain))
+
+        self.blocks.append((timestamp, transaction_sum, defi_value, ids, changes, gains))
+        self.transaction_counting += transaction_sum
+        self.defi_transactions += defi_value
+        self.cumulative_wealth_gain += gains
+
+        for values, totals, index in self.outputs:
+            values.append(float(totals[index]))
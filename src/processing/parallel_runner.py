@@ -0,0 +1,84 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from processing.multi_window import WindowSeries
+from processing.block_columns import ALGORITHMS, run_on_columns
+
+
+class SharedColumns:
+    # NumPy arrays copied once into POSIX shared memory, worker processes map them without copying.
+    # spec is picklable and is all a worker needs to attach
+    def __init__(self, spec, blocks, owner):
+        self.spec = spec
+        self.blocks = blocks
+        self.owner = owner
+        self.arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=self.blocks[name].buf)
+            for name, (_, dtype, shape) in spec.items()
+        }
+
+    @classmethod
+    def create(cls, arrays):
+        spec, blocks = {}, {}
+        try:
+            for name, array in arrays.items():
+                # zero sized shared memory is not allowed
+                blocks[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                spec[name] = (blocks[name].name, array.dtype.str, array.shape)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[name].buf)[...] = array
+        except BaseException:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        return cls(spec, blocks, owner=True)
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec, {name: shared_memory.SharedMemory(name=block) for name, (block, _, _) in spec.items()}, owner=False)
+
+    def close(self):
+        self.arrays = None
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+
+
+def run_window(spec, algorithm, delta, row):
+    # worker: evaluates one (algorithm, delta) pair over all blocks and writes its values into row of "values"
+    columns = SharedColumns.attach(spec)
+    try:
+        columns.arrays["values"][row] = run_on_columns(ALGORITHMS[algorithm](delta), columns.arrays)
+    finally:
+        columns.close()
+    return algorithm, delta
+
+
+def run_parallel(columns, analysis, processes):
+    # Evaluates every (algorithm, delta) pair of the analysis config section in its own process over the
+    # columns of DataCollector.get_block_columns. Returns {algorithm: [WindowSeries, ...]} like MultiWindow.series
+    pairs = [(algorithm, delta) for algorithm, deltas in analysis.items() for delta in deltas]
+    n_blocks = len(columns["timestamp"])
+    shared = SharedColumns.create({**columns, "values": np.zeros((len(pairs), n_blocks), dtype=np.float64)})
+    try:
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as executor:
+            # the slowest windows (CWG, then the largest deltas) first, so that they never start last
+            order = sorted(
+                range(len(pairs)),
+                key=lambda i: (pairs[i][0] != "cumulative_wealth_gain", -pairs[i][1]),
+            )
+            futures = [executor.submit(run_window, shared.spec, *pairs[i], i) for i in order]
+            for future in as_completed(futures):
+                future.result()
+
+        series = {algorithm: [] for algorithm in analysis}
+        for row, (algorithm, delta) in enumerate(pairs):
+            window = WindowSeries(delta)
+            window.values = shared.arrays["values"][row].copy()
+            series[algorithm].append(window)
+        return series
+    finally:
+        shared.close()
@@ -0,0 +1,76 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from collect.db_connection import open_db
+from collect.coverage import BlockCoverage
+
+START_TIME = datetime(2025, 6, 1)
+COINS = ["ETH", "USDC"]
+# fixes the hash prefix of each coin, also for coins ingested later
+ALL_COINS = ["ETH", "USDC", "USDT"]
+
+
+def add_block(db, number, seconds_per_block=12):
+    db.execute(
+        "INSERT OR REPLACE INTO blocks VALUES (?, ?)",
+        (number, START_TIME + timedelta(seconds=number * seconds_per_block)),
+    )
+
+
+def transfer_rows(number, coins=COINS):
+    # two plain transfers and one two leg swap per coin and block, addresses repeat across blocks
+    rows = []
+    for coin in coins:
+        c = ALL_COINS.index(coin)
+        for log_number in range(2):
+            rows.append((
+                f"0x{number:060x}{c:02x}{log_number:02x}", log_number, number, coin,
+                f"0x{(number + log_number) % 7:040x}", f"0x{(number + c) % 5:040x}",
+                1000, float(number % 11 + log_number), False, 1.0,
+            ))
+        swap = f"0x{number:060x}{c:02x}ff"
+        rows.append((swap, 10, number, coin, f"0x{number % 3:040x}", f"0x{9:040x}", 1000, 5.0, True, 1.0))
+        rows.append((swap, 11, number, coin, f"0x{9:040x}", f"0x{number % 3:040x}", 1000, 4.9, True, 1.0))
+    return rows
+
+
+def insert_transfers(db, rows):
+    transfers = pd.DataFrame(rows, columns=[
+        "hash", "log_number", "block_number", "coin", "from_addr", "to_addr",
+        "amount", "usd_value", "is_dex_swap", "token_amount",
+    ])
+    db.execute(
+        """
+        INSERT OR REPLACE INTO transactions
+          (hash, log_number, block_number, coin, from_addr, to_addr, amount, usd_value, is_dex_swap, token_amount)
+        SELECT * FROM transfers
+        """
+    )
+
+
+def add_transfers(db, number, coins=COINS):
+    insert_transfers(db, transfer_rows(number, coins))
+
+
+def ingest(db, numbers, coins=COINS, seconds_per_block=12):
+    for number in numbers:
+        add_block(db, number, seconds_per_block)
+    insert_transfers(db, [row for number in numbers for row in transfer_rows(number, coins)])
+    BlockCoverage(db).add([(number, coin) for number in numbers for coin in coins])
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "main.duckdb"
+
+
+@pytest.fixture
+def db(db_path):
+    con = open_db(db_path)
+    yield con
+    con.close()
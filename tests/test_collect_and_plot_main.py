@@ -0,0 +1,49 @@
+import asyncio
+import collect_and_plot_main
+from collect.data_manager import DataCollector
+from collect.db_connection import open_db
+from collect.coverage import BlockCoverage
+from conftest import COINS, ingest
+
+
+def config(processing):
+    return {
+        "start_block": 0,
+        "end_block": 400,
+        "batch_size": 100,
+        "token": [{"name": coin, "address": coin.lower(), "active": True, "decimals": 18} for coin in COINS],
+        "dex_events": [],
+        "analysis_db": {"read_only": True},
+        "processing": processing,
+        "plot": {"format": "html", "max_points": 100},
+        "analysis": {
+            "cumulative_wealth_gain": [24, 96],
+            "transaction_counting": [24, 96],
+            "defi_transactions": [24, 96],
+        },
+    }
+
+
+def run_main(monkeypatch, tmp_path, db, processing):
+    cfg = config(processing)
+
+    def collector(config, read_only):
+        # a read only collector over the test database, it never fetches
+        dc = DataCollector(config, open_database=False, read_only=True)
+        dc.db = db
+        dc.coverage = BlockCoverage(db, read_only=True)
+        dc.coverage_summary = dc.coverage.summary()
+        return dc
+
+    (tmp_path / "data").mkdir()
+    monkeypatch.setattr(collect_and_plot_main, "get_config", lambda: cfg)
+    monkeypatch.setattr(collect_and_plot_main, "DataCollector", collector)
+    monkeypatch.setattr(collect_and_plot_main, "PROJECT_ROOT", tmp_path)
+    asyncio.run(collect_and_plot_main.main())
+    return sorted(path.name for path in (tmp_path / "data").glob("plot_delta_*.html"))
+
+
+def test_main_with_tc_pushdown(monkeypatch, tmp_path, db):
+    ingest(db, range(400))
+    plots = run_main(monkeypatch, tmp_path, db, {"tc_pushdown": True})
+    assert plots == ["plot_delta_2.html", "plot_delta_8.html"]
@@ -0,0 +1,14 @@
+from collect.parallel_backfill import split_range
+
+
+def test_split_range_covers_the_range():
+    assert split_range(100, 110, 3) == [(100, 104), (104, 108), (108, 110)]
+
+
+def test_split_range_with_fewer_blocks_than_workers():
+    assert split_range(100, 102, 4) == [(100, 101), (101, 102)]
+
+
+def test_split_range_of_an_empty_range():
+    assert split_range(100, 100, 4) == []
+    assert split_range(110, 100, 4) == []
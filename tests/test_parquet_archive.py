@@ -0,0 +1,106 @@
+import asyncio
+from datetime import date
+import pytest
+from collect.data_manager import DataCollector
+from collect.db_connection import open_db
+from collect.coverage import BlockCoverage
+from collect.parquet_archive import export_finalized_days, delete_archived_rows, ParquetBlockReader
+from conftest import COINS, add_block, add_transfers, ingest
+
+# one block per hour, 24 blocks per day starting with block 0 on 2025-06-01
+SECONDS_PER_BLOCK = 3600
+CONFIG = {
+    "token": [{"name": coin, "address": coin.lower(), "active": True, "decimals": 18} for coin in COINS],
+    "dex_events": [],
+}
+
+
+def collector(db, archive_path=None):
+    # a read only collector over a test database, it never fetches
+    dc = DataCollector(CONFIG, open_database=False, read_only=True)
+    dc.db = db
+    dc.coverage = BlockCoverage(db, read_only=True)
+    dc.coverage_summary = dc.coverage.summary()
+    dc.archive_path = archive_path
+    return dc
+
+
+def read(dc, start_block=0, end_block=100):
+    # get_blocks with and without swaps (transaction order within a block is not defined) and get_defi_values
+    blocks = [
+        [(number, timestamp, sorted(map(str, transactions))) for number, timestamp, transactions in
+         asyncio.run(dc.get_blocks(start_block, end_block, with_dex))]
+        for with_dex in (False, True)
+    ]
+    return blocks, asyncio.run(dc.get_defi_values(start_block, end_block))
+
+
+def assert_same(hot, archived):
+    (hot_blocks, hot_defi), (archived_blocks, archived_defi) = read(hot), read(archived)
+    assert archived_blocks == hot_blocks
+    assert archived_defi == pytest.approx(hot_defi)
+
+
+@pytest.fixture
+def dbs(tmp_path):
+    # the same blocks in a database that is never compacted and in one that is
+    hot = open_db(tmp_path / "hot.duckdb")
+    compacted = open_db(tmp_path / "compacted.duckdb")
+    yield hot, compacted
+    hot.close()
+    compacted.close()
+
+
+def ingest_both(dbs, numbers, coins=COINS):
+    for db in dbs:
+        ingest(db, numbers, coins, SECONDS_PER_BLOCK)
+
+
+def test_compacted_days_read_back_unchanged(dbs, tmp_path):
+    hot, compacted = dbs
+    archive_path = tmp_path / "archive"
+    # block 30 of 2025-06-02 is not ingested yet
+    ingest_both(dbs, [n for n in range(100) if n != 30])
+
+    # 2025-06-01 has no known block before it, 2025-06-02 a gap and 2025-06-05 no known block after it
+    days = export_finalized_days(compacted, COINS, archive_path, compact_hot=True)
+    assert days == [date(2025, 6, 3), date(2025, 6, 4)]
+    assert compacted.execute("SELECT count(*) FROM blocks WHERE number BETWEEN 48 AND 95").fetchone()[0] == 0
+    assert_same(collector(hot), collector(compacted, archive_path))
+
+    # backfilling the gap finalizes 2025-06-02
+    ingest_both(dbs, [30])
+    assert export_finalized_days(compacted, COINS, archive_path, compact_hot=True) == [date(2025, 6, 2)]
+    assert_same(collector(hot), collector(compacted, archive_path))
+
+    # a block of an archived day ingested again for a new coin, read from the database and the archive at once
+    for db in dbs:
+        add_block(db, 50, SECONDS_PER_BLOCK)
+        add_transfers(db, 50, ["USDT"])
+    assert_same(collector(hot), collector(compacted, archive_path))
+
+    # the late rows are appended to the archive, only they are deleted from the database
+    assert export_finalized_days(compacted, COINS, archive_path, compact_hot=True) == []
+    assert compacted.execute("SELECT count(*) FROM transactions WHERE block_number BETWEEN 24 AND 95").fetchone()[0] == 0
+    assert_same(collector(hot), collector(compacted, archive_path))
+
+    reader = ParquetBlockReader(archive_path)
+    try:
+        usdt = reader.scan(["hash"], date(2025, 6, 3), date(2025, 6, 3), ["USDT"]).fetchall()
+    finally:
+        reader.close()
+    assert len(usdt) == 4
+
+
+def test_rows_not_in_the_archive_are_kept(dbs, tmp_path):
+    hot, compacted = dbs
+    archive_path = tmp_path / "archive"
+    ingest_both(dbs, range(100))
+    assert export_finalized_days(compacted, COINS, archive_path) == [date(2025, 6, 2), date(2025, 6, 3), date(2025, 6, 4)]
+    # rows ingested into an archived day after its export are not in the archive yet
+    for db in dbs:
+        add_transfers(db, 60, ["USDT"])
+    delete_archived_rows(compacted, archive_path)
+    assert compacted.execute("SELECT count(*) FROM transactions WHERE coin = 'USDT'").fetchone()[0] == 4
+    assert compacted.execute("SELECT count(*) FROM blocks WHERE number = 60").fetchone()[0] == 1
+    assert_same(collector(hot), collector(compacted, archive_path))
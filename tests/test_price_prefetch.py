@@ -0,0 +1,64 @@
+import asyncio
+from datetime import date, datetime
+import aiohttp
+from aiohttp import web
+from collect.price_prefetch import PricePrefetcher
+
+
+def run_fetch(handler, coin):
+    # fetch_range against a local server, returns its rows and the number of requests
+    requests = []
+
+    async def counted(request):
+        requests.append(request)
+        return await handler(request, len(requests))
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/coins/ethereum/contract/{address}/market_chart/range", counted)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        prefetcher = PricePrefetcher(None, None, base_url=f"http://127.0.0.1:{port}", calls_per_minute=6000)
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await prefetcher.fetch_range(session, coin, date(2025, 6, 1), date(2025, 6, 3))
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main()), len(requests)
+
+
+def timestamp_ms(*args):
+    return datetime(*args).timestamp() * 1000
+
+
+def test_last_price_of_a_day_wins():
+    async def handler(request, n):
+        return web.json_response({"prices": [
+            [timestamp_ms(2025, 6, 1, 0), 1.0],
+            [timestamp_ms(2025, 6, 1, 12), 2.0],
+            [timestamp_ms(2025, 6, 2, 0), 3.0],
+        ]})
+
+    rows, requests = run_fetch(handler, {"name": "USDC", "address": "0xa0"})
+    assert sorted(rows) == [("USDC", "2025-06-01", 2.0), ("USDC", "2025-06-02", 3.0)]
+    assert requests == 1
+
+
+def test_client_errors_are_not_retried():
+    async def handler(request, n):
+        raise web.HTTPNotFound()
+
+    assert run_fetch(handler, {"name": "USDC", "address": "0xa0"}) == ([], 1)
+
+
+def test_rate_limit_waits_for_retry_after():
+    async def handler(request, n):
+        if n == 1:
+            raise web.HTTPTooManyRequests(headers={"Retry-After": "0"})
+        return web.json_response({"prices": [[timestamp_ms(2025, 6, 1), 1.0]]})
+
+    assert run_fetch(handler, {"name": "USDC", "address": "0xa0"}) == ([("USDC", "2025-06-01", 1.0)], 2)